@@ -1,7 +1,21 @@
+import argparse
+import signal
+import sys
+import time
+
 import output
+from profiler import Profiler
 
 
 def main():
+    """
+    Führt einen vollständigen Lauf des Managers durch.
+
+    Returns
+    -------
+    Rückgabewert des Programms: 0, falls alle Vorgänge erfolgreich waren,
+    ansonsten 1.
+    """
     output.header('SoftwareManager')
     output.loadSoftware()
     output.printSoftwareTable()
@@ -10,17 +24,91 @@ def main():
     output.startUpdates()
     output.autostartSoftware()
     output.printSoftwareTable()
+    success = output.printSummary()
+    sampler = output.startSampler()
+    # Profiliert wird nur der Start; das anschließende Warten würde den
+    # Bericht sonst dominieren.
+    Profiler.stop()
 
+    # Ein Herunterfahren per SIGTERM (etwa durch systemd) wird wie Strg+C
+    # behandelt, damit die Messungen auch dann gesichert werden.
+    signal.signal(signal.SIGTERM, terminate)
     try:
         while True:
-            pass
+            time.sleep(1)
     except KeyboardInterrupt:
         print('Beende…')
-        pass
+    finally:
+        output.stopSampler(sampler)
 
+    return 0 if success else 1
+
+
+def terminate(signum, frame):
+    """
+    Signalhandler, der den Manager wie bei Strg+C beendet.
+    """
+    raise KeyboardInterrupt
+
+
+def run(command):
+    """
+    Führt einen Befehl des Managers aus.
+
+    Parameters
+    ----------
+    command : str
+        Einer der Befehle `run`, `build-index`, `export-stats` oder `usage`.
+
+    Returns
+    -------
+    Rückgabewert des Programms.
+    """
+    if command == 'build-index':
+        output.init()
+        output.buildIndex()
+        output.deinit()
+        return 0
+    if command == 'export-stats':
+        output.exportStatistics(sys.stdout)
+        return 0
+    if command == 'usage':
+        output.printUsage()
+        return 0
 
-if __name__ == '__main__':
     output.init()
-    main()
+    code = main()
     output.deinit()
-    exit(0)
+    return code
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Installiert, aktualisiert '
+                                     'und startet Software aus einer '
+                                     'Repository.')
+    parser.add_argument('command', nargs='?', default='run',
+                        choices=['run', 'build-index', 'export-stats',
+                                 'usage'],
+                        help='run: vollständiger Lauf (Standard); '
+                        'build-index: Index der Repository erstellen; '
+                        'export-stats: Dauer vergangener Phasen je Software '
+                        'als CSV ausgeben; usage: gemessenen '
+                        'Ressourcenverbrauch je Software ausgeben')
+    parser.add_argument('--profile', nargs='?', const='profile',
+                        metavar='DIR',
+                        help='Lauf profilieren und Bericht samt gefalteter '
+                        'Stacks für Flamegraphs in DIR ablegen (Standard: '
+                        'profile)')
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        # Importzeiten lassen sich nur beim Start des Interpreters messen,
+        # daher startet sich der Manager dafür neu.
+        if not Profiler.isChild():
+            exit(Profiler.launch(__file__, sys.argv[1:], args.profile))
+        Profiler.start()
+    try:
+        code = run(args.command)
+    finally:
+        Profiler.stop()
+    exit(code)
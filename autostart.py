@@ -0,0 +1,109 @@
+import os
+import threading
+
+from database import Database
+
+
+class Autostart:
+    """
+    Startet automatisch auszuführende Software in Abhängigkeitsreihenfolge.
+    Jede Software wird erst gestartet, wenn alle Software, von der sie
+    (ggf. indirekt) abhängt, bereit ist. Gleichzeitig befinden sich höchstens
+    `concurrency` Prozesse in der Startphase, also zwischen dem Start und dem
+    Erreichen ihrer Bereitschaft.
+    """
+
+    # Maximale Anzahl an Software, die gleichzeitig gestartet wird.
+    concurrency = os.cpu_count() or 1
+
+    @staticmethod
+    def setConcurrency(concurrency):
+        """
+        Setzt die maximale Anzahl gleichzeitig startender Software.
+
+        Parameters
+        ----------
+        concurrency : int
+            Maximale Anzahl; bei None bleibt die Anzahl der Kerne bestehen.
+        """
+        if concurrency is None: return
+        Autostart.concurrency = max(1, int(concurrency))
+
+    @staticmethod
+    def getRunnableDependencies(software):
+        """
+        Ermittelt die automatisch startende Software, auf deren Bereitschaft
+        die übergebene Software warten muss. Nicht startende Abhängigkeiten
+        werden dabei übersprungen, deren Abhängigkeiten aber berücksichtigt.
+
+        Parameters
+        ----------
+        software : Software
+            Software, deren Abhängigkeiten ermittelt werden sollen.
+
+        Returns
+        -------
+        Menge der Slugs automatisch startender Abhängigkeiten.
+        """
+        result = set()
+        visited = set()
+        pending = list(software.getDependencies())
+        while pending:
+            slug = pending.pop()
+            if slug in visited or slug not in Database.software: continue
+            visited.add(slug)
+            dependency = Database.software[slug]
+            if dependency.isRunnable(): result.add(slug)
+            else: pending.extend(dependency.getDependencies())
+        return result
+
+    @staticmethod
+    def start(software):
+        """
+        Startet die übergebene Software und kehrt zurück, sobald jede entweder
+        bereit ist oder sich im Fehlerzustand befindet.
+
+        Parameters
+        ----------
+        software : list(Software)
+            Automatisch zu startende Software.
+        """
+        slugs = set(s.slug for s in software)
+        order = [Database.software[slug] for slug
+                 in Database.getDependencyOrder() if slug in slugs]
+        position = {s.slug: i for i, s in enumerate(order)}
+        done = {slug: threading.Event() for slug in slugs}
+        semaphore = threading.BoundedSemaphore(Autostart.concurrency)
+
+        def worker(s):
+            try:
+                for slug in Autostart.getRunnableDependencies(s):
+                    if slug not in done: continue
+                    # Gewartet wird nur auf Software, die in der Reihenfolge
+                    # davor steht. Alles andere ist Teil eines Zyklus, auf den
+                    # ewig gewartet würde.
+                    if position[slug] >= position[s.slug]:
+                        return s.setError('Zyklische Abhängigkeit zu %s.'
+                                          % slug)
+                    done[slug].wait()
+                    if Database.software[slug].hasError():
+                        # Meist wurde der Fehler bereits von der Datenbank an
+                        # diese Software weitergegeben.
+                        if s.hasError(): return
+                        return s.setError('Abhängigkeit %s wurde nicht '
+                                          'bereit.' % slug)
+                with semaphore:
+                    s.run()
+                    s.waitReady()
+            except Exception as e:
+                s.setError('Start fehlgeschlagen: %s' % e)
+            finally:
+                done[s.slug].set()
+
+        # Die Threads werden in Abhängigkeitsreihenfolge erzeugt, damit bei
+        # knappen Plätzen die Software mit den wenigsten Voraussetzungen zuerst
+        # zum Zug kommt.
+        threads = [threading.Thread(target=worker, args=(s,), daemon=True)
+                   for s in order]
+        for t in threads: t.start()
+        for t in threads: t.join()
@@ -1,9 +1,15 @@
+from datetime import datetime
 import os
 import semver
-import subprocess
-import sys
+import statistics
+import threading
+import time
 import yaml
 
+from environment import Environment
+from index import Index, LazySoftware
+from policy import Policy
+from profiler import Profiler
 from software import Software
 
 
@@ -35,6 +41,47 @@ class Database:
     # Deskriptoren.
     repository = None
 
+    # Pfad zur Datei, in der Fehler der Software festgehalten werden.
+    fileErrors = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'errors.yml')
+
+    # Fehler der Software. Ein Dictionary, das zu jedem Slug, der sich beim
+    # letzten Lauf im Fehlerzustand befand, Grund und Zeitpunkt enthält. Wird
+    # getrennt von der `database` geführt, da auch nie installierte Software
+    # fehlschlagen kann.
+    errors = None
+
+    # Pfad zur Datei, in der die Dauer vergangener Phasen festgehalten wird.
+    fileHistory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'history.yml')
+
+    # Dauer vergangener Phasen. Ein Dictionary, das zu jedem Slug ein weiteres
+    # Dictionary mit den Phasen `pip`, `install` und `update` als Key und der
+    # Liste der letzten Dauern in Sekunden als Value enthält.
+    history = None
+
+    # Anzahl an Dauern, die je Software und Phase aufbewahrt werden.
+    historySize = 20
+
+    # Beginn der aktuell laufenden Phasen je Slug.
+    phaseStarts = {}
+
+    # Zuordnung der Status zu den Phasen, die mit ihnen beginnen bzw. enden.
+    PHASE_STARTS = {
+        Software.INSTALLING_PIP_DEPENDENCIES: 'pip',
+        Software.INSTALLING: 'install',
+        Software.UPDATING: 'update',
+    }
+    PHASE_ENDS = {
+        Software.INSTALLING_DEPENDENCIES: 'pip',
+        Software.INSTALLED: 'install',
+        Software.UPDATED: 'update',
+    }
+
+    # Sperre für Änderungen an Datenbank und Fehlern, da Statusänderungen auch
+    # aus mehreren Threads heraus erfolgen können.
+    lock = threading.RLock()
+
     @staticmethod
     def init():
         """
@@ -50,6 +97,7 @@ class Database:
         # der Klasse an. So können Installations-, Deinstallations- und Update-
         # Events abgegriffen werden.
         Software.registerStateListener(Database.softwareUpdated)
+        Software.registerStateListener(Database.propagateError, late=True)
 
     @staticmethod
     def readSoftware(repository):
@@ -63,12 +111,63 @@ class Database:
             Pfad zum Verzeichnis mit allen Softwaredeskriptoren.
         """
         Database.repository = repository
-        dirs = [f.path for f in os.scandir(repository) if f.is_dir()]
-        for d in dirs:
-            s = Software(d)
-            s.setState(Software.INSTALLED if Database.hasSoftware(s) else
-                       Software.UNINSTALLED)
-            Database.software[s.slug] = s
+
+        # Bevorzugt den vorkompilierten Index nutzen; die Software-Objekte
+        # werden dann erst beim ersten Zugriff erstellt.
+        index = Index.open(repository)
+        if index is not None:
+            def create(slug):
+                entry = index.getEntry(slug)
+                return Database.initSoftware(Software(
+                    os.path.join(repository, slug), entry['config'],
+                    entry['scripts']))
+            Database.software = LazySoftware(index.getSlugs(), create)
+        else:
+            dirs = [f.path for f in os.scandir(repository) if f.is_dir()]
+            for d in dirs:
+                s = Database.initSoftware(Software(d))
+                Database.software[s.slug] = s
+
+        # Einträge aus Versionen ohne festgehaltene Abhängigkeiten ergänzen,
+        # solange die Software noch in der Repository ist. Sonst wären sie
+        # unbekannt, sobald die Software veraltet und entfernt werden soll.
+        changed = False
+        for slug, entry in Database.database.items():
+            if 'dependencies' in entry or slug not in Database.software:
+                continue
+            entry['dependencies'] = \
+                list(Database.software[slug].getDependencies())
+            changed = True
+        if changed: Database.save()
+
+        # Fehler von Software, die weder in der Repository noch in der
+        # Datenbank ist, sind hinfällig.
+        for slug in list(Database.errors):
+            if slug in Database.software or slug in Database.database:
+                continue
+            del Database.errors[slug]
+            Database.saveErrors()
+
+    @staticmethod
+    def initSoftware(software):
+        """
+        Setzt den Anfangsstatus einer frisch eingelesenen Software anhand der
+        Datenbank. Die Listener werden dabei bewusst nicht informiert, da es
+        sich um keine Statusänderung handelt und die Software bei Nutzung des
+        Index auch erst später eingelesen werden kann.
+
+        Parameters
+        ----------
+        software : Software
+            Die eingelesene Software.
+
+        Returns
+        -------
+        Die übergebene Software.
+        """
+        software.state = Software.INSTALLED if Database.hasSoftware(software) \
+            else Software.UNINSTALLED
+        return software
 
     @staticmethod
     def load():
@@ -77,6 +176,14 @@ class Database:
         """
         with open(Database.file, 'r') as f:
             Database.database = yaml.full_load(f) or {}
+        Database.errors = {}
+        if os.path.exists(Database.fileErrors):
+            with open(Database.fileErrors, 'r') as f:
+                Database.errors = yaml.full_load(f) or {}
+        Database.history = {}
+        if os.path.exists(Database.fileHistory):
+            with open(Database.fileHistory, 'r') as f:
+                Database.history = yaml.full_load(f) or {}
 
     @staticmethod
     def save():
@@ -86,11 +193,256 @@ class Database:
         with open(Database.file, 'w') as f:
             yaml.dump(Database.database, f)
 
+    @staticmethod
+    def saveErrors():
+        """
+        Speichert die Fehler in der entsprechenden Datei.
+        """
+        with open(Database.fileErrors, 'w') as f:
+            yaml.dump(Database.errors, f)
+
+    @staticmethod
+    def saveHistory():
+        """
+        Speichert die Dauer vergangener Phasen in der entsprechenden Datei.
+        """
+        with open(Database.fileHistory, 'w') as f:
+            yaml.dump(Database.history, f)
+
+    @staticmethod
+    def propagateError(software):
+        """
+        Setzt alle Software, die (ggf. indirekt) von einer fehlerhaften
+        Software abhängt, ebenfalls in den Fehlerzustand. Wird erst nach allen
+        übrigen Listenern aufgerufen, damit die Ursache vor ihren Folgen
+        gemeldet wird.
+
+        Parameters
+        ----------
+        software : Software
+            Das Software-Objekt, das seinen Status geändert hat.
+        """
+        if not software.hasError(): return
+        with Database.lock:
+            # Abhängige Software kann so nicht mehr sinnvoll arbeiten. Das
+            # Setzen des Fehlers löst rekursiv dieselbe Behandlung aus.
+            for dependent in Database.getDependents(software.slug):
+                if dependent.hasError(): continue
+                dependent.setError('Abhängigkeit %s ist fehlerhaft.'
+                                   % software.getName())
+
     @staticmethod
     def softwareUpdated(software):
         """
         Reagiert auf eine Statusänderung einer Software.
 
+        Parameters
+        ----------
+        software : Software
+            Das Software-Objekt, das seinen Status geändert hat.
+        """
+        with Database.lock:
+            Database.updateHistory(software)
+            Database.updateErrors(software)
+            Database.updateDatabase(software)
+
+    @staticmethod
+    def updateHistory(software):
+        """
+        Misst anhand der Statusänderungen die Dauer der Phasen `pip`,
+        `install` und `update` und hält sie fest. Fehlgeschlagene Phasen
+        werden verworfen.
+
+        Parameters
+        ----------
+        software : Software
+            Das Software-Objekt, das seinen Status geändert hat.
+        """
+        starts = Database.phaseStarts.setdefault(software.slug, {})
+        if software.hasError():
+            starts.clear()
+            return
+
+        phase = Database.PHASE_ENDS.get(software.state)
+        if phase in starts:
+            duration = time.monotonic() - starts.pop(phase)
+            durations = Database.history.setdefault(software.slug, {}) \
+                .setdefault(phase, [])
+            durations.append(round(duration, 2))
+            del durations[:-Database.historySize]
+            Database.saveHistory()
+
+        phase = Database.PHASE_STARTS.get(software.state)
+        if phase is not None: starts[phase] = time.monotonic()
+
+    @staticmethod
+    def getEstimate(slug, phase):
+        """
+        Schätzt die Dauer einer Phase anhand des Medians ihrer bisherigen
+        Dauern. Gibt es für die Software noch keine, wird der Median über alle
+        Software herangezogen.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der betroffenen Software.
+        phase : str
+            Eine der Phasen `pip`, `install` oder `update`.
+
+        Returns
+        -------
+        Geschätzte Dauer in Sekunden; 0, falls keinerlei Erfahrungswerte
+        vorliegen.
+        """
+        durations = Database.history.get(slug, {}).get(phase)
+        if not durations:
+            durations = [d for h in Database.history.values()
+                         for d in h.get(phase, [])]
+        return statistics.median(durations) if durations else 0
+
+    @staticmethod
+    def getStatistics():
+        """
+        Fasst die Dauer vergangener Phasen je Software zusammen, etwa für die
+        Kapazitätsplanung.
+
+        Returns
+        -------
+        Liste von Dictionaries mit Slug, Phase, Anzahl, Median, Mittelwert,
+        Minimum, Maximum und letzter Dauer in Sekunden.
+        """
+        rows = []
+        for slug, phases in sorted(Database.history.items()):
+            for phase, durations in sorted(phases.items()):
+                if not durations: continue
+                rows.append({
+                    'slug': slug,
+                    'phase': phase,
+                    'count': len(durations),
+                    'median': round(statistics.median(durations), 2),
+                    'mean': round(statistics.mean(durations), 2),
+                    'min': min(durations),
+                    'max': max(durations),
+                    'last': durations[-1],
+                })
+        return rows
+
+    @staticmethod
+    def getSchedule(software, estimate):
+        """
+        Ordnet Software nach dem Prinzip des kritischen Pfads: Jede Software
+        erhält als Priorität ihre eigene geschätzte Dauer zuzüglich der
+        längsten Kette von Software, die (ggf. indirekt) von ihr abhängt.
+        Unter der Software, deren Abhängigkeiten bereits eingeplant sind, wird
+        jeweils die mit der höchsten Priorität als nächste gewählt. So kommen
+        die längsten Abhängigkeitsketten zuerst an die Reihe.
+
+        Parameters
+        ----------
+        software : list(Software)
+            Einzuplanende Software.
+        estimate : func(Software)
+            Funktion, die die geschätzte Dauer einer Software liefert.
+
+        Returns
+        -------
+        Liste der Software in der geplanten Reihenfolge.
+        """
+        bySlug = {s.slug: s for s in software}
+        dependents = {slug: [] for slug in bySlug}
+        dependencies = {}
+        for s in software:
+            dependencies[s.slug] = set(d for d in s.getDependencies()
+                                       if d in bySlug and d != s.slug)
+            for d in dependencies[s.slug]: dependents[d].append(s.slug)
+
+        priority = {}
+
+        def getPriority(slug, path):
+            if slug in priority: return priority[slug]
+            # Zyklen werden an dieser Stelle abgeschnitten.
+            chain = [getPriority(d, path | {slug}) for d in dependents[slug]
+                     if d not in path and d != slug]
+            priority[slug] = estimate(bySlug[slug]) + max(chain, default=0)
+            return priority[slug]
+
+        for slug in bySlug: getPriority(slug, set())
+
+        schedule = []
+        pending = set(bySlug)
+        while pending:
+            ready = [slug for slug in pending
+                     if not dependencies[slug] & pending]
+            # Bei zyklischen Abhängigkeiten ist nichts bereit; dann wird
+            # dennoch die wichtigste Software eingeplant.
+            slug = max(ready or pending, key=lambda s: (priority[s], s))
+            pending.remove(slug)
+            schedule.append(bySlug[slug])
+        return schedule
+
+    @staticmethod
+    def updateErrors(software):
+        """
+        Hält Fehler einer Software fest. Erreicht eine Software wieder einen
+        fehlerfreien Zustand, wird ihr Fehler gelöscht.
+
+        Parameters
+        ----------
+        software : Software
+            Das Software-Objekt, das seinen Status geändert hat.
+        """
+        if software.state in [Software.ERROR, Software.TIMEOUT]:
+            Database.recordError(software.slug, software.error_msg,
+                                 software.state == Software.TIMEOUT)
+
+        elif software.state in [Software.INSTALLED, Software.UPDATED,
+                                Software.AUTOSTARTED]:
+            Database.clearError(software.slug)
+
+    @staticmethod
+    def recordError(slug, reason, timeout=False):
+        """
+        Hält den Fehler einer Software dauerhaft fest.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der fehlerhaften Software.
+        reason : str
+            Grund des Fehlers.
+        timeout : bool
+            Ob der Fehler eine Zeitüberschreitung war.
+        """
+        with Database.lock:
+            Database.errors[slug] = {
+                'reason': reason,
+                'state': 'timeout' if timeout else 'error',
+                'time': datetime.now().isoformat(timespec='seconds'),
+            }
+            Database.saveErrors()
+
+    @staticmethod
+    def getCurrentErrors():
+        """
+        Ermittelt die Fehler, die im aktuellen Lauf bestehen: die der Software
+        im Fehlerzustand sowie die veralteter Software, deren Entfernung
+        fehlgeschlagen ist.
+
+        Returns
+        -------
+        Dictionary mit Slug als Key und Fehlergrund als Value.
+        """
+        with Database.lock:
+            return {slug: error['reason']
+                    for slug, error in Database.errors.items()
+                    if slug not in Database.software
+                    or Database.software[slug].hasError()}
+
+    @staticmethod
+    def updateDatabase(software):
+        """
+        Überträgt eine Statusänderung einer Software in die Datenbank.
+
         Parameters
         ----------
         software : Software
@@ -100,8 +452,12 @@ class Database:
                 and not Database.hasSoftware(software):
             # Software wurde neu installiert und muss der Datenbank hinzugefügt
             # werden.
+            # Die Abhängigkeiten werden mit festgehalten, damit veraltete
+            # Software später in der richtigen Reihenfolge entfernt werden
+            # kann, auch wenn sie nicht mehr in der Repository ist.
             Database.database[software.slug] = {
                 'version': str(software.getVersion()),
+                'dependencies': list(software.getDependencies()),
             }
 
         elif software.state == Software.UNINSTALLED \
@@ -114,6 +470,8 @@ class Database:
             # Software hat die Version geändert.
             Database.database[software.slug]['version'] = \
                 str(software.getVersion())
+            Database.database[software.slug]['dependencies'] = \
+                list(software.getDependencies())
 
         else: return
 
@@ -139,15 +497,80 @@ class Database:
         return software.slug in Database.database
 
     @staticmethod
-    def updateSoftware():
+    def getUpdatableSoftware():
         """
-        Löst die Update-Sequenz für die Software aus, deren Version aktueller
-        als die in der Datenbank hinterlegten ist.
+        Ermittelt die Software, deren Version in der Repository aktueller als
+        die in der Datenbank hinterlegte ist.
+
+        Returns
+        -------
+        Dictionary mit der zu aktualisierenden Software als Key und der
+        aktuell installierten Version als Value.
         """
+        result = {}
         for slug, software in Database.software.items():
+            # Fehlgeschlagene Installationen sind nicht in der Datenbank und
+            # werden hier übersprungen.
+            if slug not in Database.database: continue
             currVer = Database.database[slug].get('version') or '0.0.0'
             if software.getVersion() > semver.VersionInfo.parse(currVer):
-                software.update(currVer)
+                result[software] = currVer
+        return result
+
+    @staticmethod
+    def updateSoftware():
+        """
+        Löst die Update-Sequenz für die Software aus, deren Version aktueller
+        als die in der Datenbank hinterlegten ist.
+        """
+        for software, currVer in Database.getUpdatableSoftware().items():
+            software.update(currVer)
+
+    @staticmethod
+    def getDependencyOrder():
+        """
+        Ermittelt eine Reihenfolge der Software in der Repository, in der jede
+        Software erst nach all ihren Abhängigkeiten kommt. Abhängigkeiten, die
+        nicht in der Repository sind, werden dabei ignoriert; Software in
+        zyklischen Abhängigkeiten wird in einer beliebigen Reihenfolge
+        angehängt.
+
+        Returns
+        -------
+        Liste der Slugs in Abhängigkeitsreihenfolge.
+        """
+        order = []
+        visited = set()
+
+        def visit(slug, path):
+            if slug in visited or slug in path: return
+            path.add(slug)
+            for d in Database.software[slug].getDependencies():
+                if d in Database.software: visit(d, path)
+            path.remove(slug)
+            visited.add(slug)
+            order.append(slug)
+
+        for slug in Database.software: visit(slug, set())
+        return order
+
+    @staticmethod
+    def getDependents(slug):
+        """
+        Ermittelt die Software in der Repository, die direkt von der mit dem
+        entsprechenden Slug bezeichneten Software abhängt.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der Software, deren abhängige Software gesucht wird.
+
+        Returns
+        -------
+        Liste der abhängigen Software-Objekte.
+        """
+        return [s for s in Database.software.values()
+                if slug in s.getDependencies()]
 
     @staticmethod
     def getOldSoftware():
@@ -158,6 +581,43 @@ class Database:
         return [s for s in Database.database.keys()
                 if s not in Database.software]
 
+    @staticmethod
+    def getRecordedDependencies(slug):
+        """
+        Gibt die bei der Installation in der Datenbank festgehaltenen
+        Abhängigkeiten einer Software zurück. Wurden keine festgehalten, wird
+        auf die Repository zurückgegriffen, sofern die Software dort noch ist.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der installierten Software.
+
+        Returns
+        -------
+        Liste der Slugs, von denen die Software abhängt.
+        """
+        entry = Database.database.get(slug) or {}
+        if 'dependencies' in entry: return entry['dependencies'] or []
+        if slug in Database.software:
+            return Database.software[slug].getDependencies()
+        return []
+
+    @staticmethod
+    def clearError(slug):
+        """
+        Löscht den festgehaltenen Fehler einer Software, sofern vorhanden.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der Software.
+        """
+        with Database.lock:
+            if slug not in Database.errors: return
+            del Database.errors[slug]
+            Database.saveErrors()
+
     @staticmethod
     def isSlugSafeToUninstall(slug):
         """
@@ -183,18 +643,23 @@ class Database:
     def uninstallOldSlug(slug):
         """
         Deinstalliert veraltete Software nach Slug. Wenn es Abhängigkeiten von
-        dieser Software gibt, wird der Vorgang abgebrochen.
+        dieser Software gibt, wird der Vorgang abgebrochen. Schlägt das
+        Deinstallationsskript fehl, wird ein `ScriptError` geworfen und die
+        Software verbleibt in der Datenbank.
         """
         if slug in Database.software: return
         if not Database.isSlugSafeToUninstall(slug): return
         uninstaller = os.path.join(Software.dirUninstaller, slug + '.py')
         if os.path.exists(uninstaller):
-            subprocess.check_call([sys.executable, slug + '.py',
-                                   Software.dirTarget],
-                                  cwd=Software.dirUninstaller)
+            with Profiler.attribute(slug, 'uninstall'):
+                Policy.call([Environment.getInterpreter(slug), slug + '.py',
+                             os.path.join(Software.dirTarget, slug)],
+                            cwd=Software.dirUninstaller)
             os.remove(uninstaller)
-        del Database.database[slug]
-        Database.save()
+        if Environment.isEnabled(): Environment(slug).remove()
+        with Database.lock:
+            del Database.database[slug]
+            Database.save()
 
 
 Database.init()
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import sysconfig
+import venv
+import yaml
+
+from policy import Policy
+
+
+class Environment:
+    """
+    Virtuelle Python-Umgebung einer einzelnen Software. Ist die Isolation
+    aktiviert, erhält jeder Slug eine eigene Umgebung, in die seine PIP-Pakete
+    installiert werden und mit deren Interpreter seine Skripte laufen.
+
+    Die Pakete selbst werden dabei nur einmal je Version in einem gemeinsamen,
+    inhaltsadressierten Speicher abgelegt und per Hardlink in die einzelnen
+    Umgebungen eingehängt. So kosten viele Umgebungen kaum mehr Platz und Zeit
+    als eine einzige.
+
+    Attributes
+    ----------
+    slug : str
+        Slug der Software, zu der diese Umgebung gehört.
+    path : str
+        Verzeichnis der virtuellen Umgebung.
+    """
+
+    # Basisverzeichnis, in dem die Umgebungen und der gemeinsame Paketspeicher
+    # liegen. Ist es nicht gesetzt, ist die Isolation deaktiviert und alle
+    # Software nutzt den Interpreter des Managers.
+    dirBase = None
+
+    # Name des Unterordners im Basisverzeichnis, der den Paketspeicher enthält.
+    # Durch den Punkt kann er nicht mit einem Slug kollidieren.
+    dirStore = '.store'
+
+    # Datei innerhalb einer Umgebung, in der die eingehängten Speichereinträge
+    # vermerkt werden.
+    manifest = 'store.yml'
+
+    def __init__(self, slug):
+        """
+        Erstellt das Umgebungs-Objekt für die entsprechende Software.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der Software, deren Umgebung verwaltet werden soll.
+        """
+        self.slug = slug
+        self.path = os.path.join(Environment.dirBase, slug)
+
+    @staticmethod
+    def setBaseDir(dirBase):
+        """
+        Setzt das Basisverzeichnis für Umgebungen und aktiviert damit die
+        Isolation.
+
+        Parameters
+        ----------
+        dirBase : str
+            Verzeichnis, in dem die Umgebungen angelegt werden sollen. Bei None
+            wird die Isolation deaktiviert.
+        """
+        Environment.dirBase = dirBase
+
+    @staticmethod
+    def isEnabled():
+        """
+        Ermittelt, ob Software in eigenen Umgebungen isoliert werden soll.
+
+        Returns
+        -------
+        Ob die Isolation aktiviert ist.
+        """
+        return Environment.dirBase is not None
+
+    @staticmethod
+    def getInterpreter(slug):
+        """
+        Gibt den Interpreter zurück, mit dem Skripte einer Software ausgeführt
+        werden sollen.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der betroffenen Software.
+
+        Returns
+        -------
+        Pfad zum Interpreter der Umgebung, sofern die Isolation aktiviert ist
+        und die Umgebung existiert, ansonsten der des Managers.
+        """
+        if not Environment.isEnabled(): return sys.executable
+        env = Environment(slug)
+        if not env.exists(): return sys.executable
+        return env.getPython()
+
+    def getPaths(self):
+        """
+        Ermittelt die Installationspfade innerhalb der Umgebung.
+
+        Returns
+        -------
+        Dictionary mit den Pfaden der Umgebung nach `sysconfig`-Schema.
+        """
+        # Das Standardschema kann von Distributionen angepasst sein (etwa
+        # `posix_local` unter Debian) und passt dann nicht zum Aufbau einer
+        # virtuellen Umgebung. Vor Python 3.11 gibt es kein `venv`-Schema.
+        if 'venv' in sysconfig.get_scheme_names(): scheme = 'venv'
+        elif os.name == 'nt': scheme = 'nt'
+        else: scheme = 'posix_prefix'
+        return sysconfig.get_paths(scheme=scheme,
+                                   vars={'base': self.path,
+                                         'platbase': self.path})
+
+    def getPython(self):
+        """
+        Gibt den Pfad zum Interpreter der Umgebung zurück.
+
+        Returns
+        -------
+        Pfad zum Python-Interpreter innerhalb der Umgebung.
+        """
+        name = 'python.exe' if os.name == 'nt' else 'python'
+        return os.path.join(self.getPaths()['scripts'], name)
+
+    def exists(self):
+        """
+        Ermittelt, ob die Umgebung bereits angelegt wurde.
+
+        Returns
+        -------
+        Ob der Interpreter der Umgebung vorhanden ist.
+        """
+        return os.path.exists(self.getPython())
+
+    def create(self):
+        """
+        Legt die Umgebung (neu) an. PIP wird dabei bewusst nicht installiert,
+        da die Pakete aus dem gemeinsamen Speicher eingehängt werden.
+        """
+        venv.EnvBuilder(clear=True, with_pip=False).create(self.path)
+
+    def remove(self):
+        """
+        Löscht die Umgebung vollständig. Der gemeinsame Paketspeicher bleibt
+        davon unberührt.
+        """
+        if os.path.exists(self.path): shutil.rmtree(self.path)
+
+    def installPackages(self, packages, timeout=None):
+        """
+        Installiert die übergebenen PIP-Pakete in die Umgebung. Dazu werden
+        die Pakete samt ihrer Abhängigkeiten zu festen Versionen aufgelöst,
+        fehlende Versionen im Speicher abgelegt und anschließend alle per
+        Hardlink in die Umgebung eingehängt. Hat sich die Paketliste seit dem
+        letzten Aufruf geändert, wird die Umgebung neu aufgebaut.
+
+        Parameters
+        ----------
+        packages : list(str)
+            Anforderungen im PIP-Format, beispielsweise `numpy>=1.20`.
+        timeout : float
+            Zeitbegrenzung je PIP-Aufruf in Sekunden.
+        """
+        pinned = Environment.resolve(packages, timeout)
+        keys = [Environment.storeEntry(name, version, timeout)
+                for name, version in pinned]
+
+        if self.exists() and self.getManifest() == sorted(keys): return
+        self.create()
+        sitePackages = self.getPaths()['purelib']
+        for key in keys:
+            Environment.linkTree(
+                os.path.join(Environment.dirBase, Environment.dirStore, key),
+                sitePackages)
+
+        with open(os.path.join(self.path, Environment.manifest), 'w') as f:
+            yaml.dump(sorted(keys), f)
+
+    def getManifest(self):
+        """
+        Liest die in der Umgebung eingehängten Speichereinträge aus.
+
+        Returns
+        -------
+        Sortierte Liste der Schlüssel der Speichereinträge oder None, falls
+        kein Manifest vorhanden ist.
+        """
+        path = os.path.join(self.path, Environment.manifest)
+        if not os.path.exists(path): return None
+        with open(path, 'r') as f:
+            return yaml.full_load(f) or []
+
+    @staticmethod
+    def resolve(packages, timeout=None):
+        """
+        Löst die Anforderungen samt aller Abhängigkeiten zu festen Versionen
+        auf, ohne dabei etwas zu installieren.
+
+        Parameters
+        ----------
+        packages : list(str)
+            Anforderungen im PIP-Format.
+        timeout : float
+            Zeitbegrenzung des PIP-Aufrufs in Sekunden.
+
+        Returns
+        -------
+        Liste von Tupeln aus Paketname und Version.
+        """
+        if len(packages) < 1: return []
+        report = Policy.call(
+            [sys.executable, '-m', 'pip', 'install', '--dry-run', '--quiet',
+             '--ignore-installed', '--report', '-'] + list(packages),
+            transient=True, capture=True, timeout=timeout)
+        return [(p['metadata']['name'], p['metadata']['version'])
+                for p in json.loads(report)['install']]
+
+    @staticmethod
+    def storeEntry(name, version, timeout=None):
+        """
+        Stellt sicher, dass ein Paket in der entsprechenden Version im Speicher
+        vorhanden ist, und installiert es andernfalls dorthin. Der Schlüssel
+        berücksichtigt neben Name und Version auch Interpreter und Plattform,
+        da kompilierte Pakete nur dort nutzbar sind.
+
+        Parameters
+        ----------
+        name : str
+            Name des Pakets.
+        version : str
+            Exakte Version des Pakets.
+        timeout : float
+            Zeitbegrenzung des PIP-Aufrufs in Sekunden.
+
+        Returns
+        -------
+        Schlüssel des Speichereintrags (zugleich sein Verzeichnisname).
+        """
+        ident = '|'.join([name.lower(), version, sys.implementation.cache_tag,
+                          sysconfig.get_platform(), platform.machine()])
+        key = '%s-%s-%s' % (name.lower(), version,
+                            hashlib.sha256(ident.encode()).hexdigest()[:16])
+        store = os.path.join(Environment.dirBase, Environment.dirStore)
+        entry = os.path.join(store, key)
+        if os.path.exists(entry): return key
+
+        # Erst in ein temporäres Verzeichnis installieren und dieses dann
+        # atomar umbenennen. So sehen parallele Installationen nie einen
+        # halbfertigen Eintrag.
+        os.makedirs(store, exist_ok=True)
+        tmp = '%s.tmp-%d' % (entry, os.getpid())
+        if os.path.exists(tmp): shutil.rmtree(tmp)
+        Policy.call([sys.executable, '-m', 'pip', 'install', '--no-deps',
+                     '--ignore-installed', '--quiet', '--target', tmp,
+                     '%s==%s' % (name, version)], transient=True,
+                    timeout=timeout)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Ein anderer Prozess war schneller – dessen Eintrag ist genauso
+            # gut.
+            shutil.rmtree(tmp)
+        return key
+
+    @staticmethod
+    def linkTree(source, target):
+        """
+        Hängt alle Dateien eines Speichereintrags per Hardlink in ein
+        Zielverzeichnis ein. Ist ein Hardlink nicht möglich (etwa über
+        Dateisystemgrenzen hinweg), wird stattdessen kopiert.
+
+        Parameters
+        ----------
+        source : str
+            Verzeichnis des Speichereintrags.
+        target : str
+            Verzeichnis, in das eingehängt werden soll.
+        """
+        for root, dirs, files in os.walk(source):
+            rel = os.path.relpath(root, source)
+            # Konsolenskripte verweisen per Shebang auf den Interpreter des
+            # Managers und sind in der Umgebung daher nicht zu gebrauchen.
+            if rel == '.' and 'bin' in dirs: dirs.remove('bin')
+            dest = os.path.normpath(os.path.join(target, rel))
+            os.makedirs(dest, exist_ok=True)
+            for f in files:
+                dst = os.path.join(dest, f)
+                if os.path.exists(dst): continue
+                try:
+                    os.link(os.path.join(root, f), dst)
+                except OSError:
+                    shutil.copy2(os.path.join(root, f), dst)
@@ -0,0 +1,300 @@
+from collections.abc import MutableMapping
+import hashlib
+import json
+import mmap
+import os
+import struct
+import subprocess
+import yaml
+
+
+class Index:
+    """
+    Vorkompilierter Index einer Repository. Statt bei jedem Start alle
+    Softwareordner zu durchsuchen und ihre YAML-Dateien zu parsen, wird die
+    gesamte Repository einmalig in eine versionierte Binärdatei übersetzt, die
+    beim Start per mmap eingeblendet wird. Die Einträge werden erst beim
+    Zugriff dekodiert.
+
+    Aufbau der Datei: Kopf (`HEADER`), danach je Software ein Tabelleneintrag
+    (`ENTRY`) mit Position und Länge von Slug und Daten, danach die Slugs und
+    die Daten selbst als UTF-8-kodiertes JSON.
+
+    Attributes
+    ----------
+    repository : str
+        Verzeichnis der Repository, zu der der Index gehört.
+    data : mmap.mmap
+        Eingeblendeter Inhalt der Indexdatei.
+    entries : dict
+        Position und Länge der Daten je Slug.
+    """
+
+    # Name der Indexdatei im Verzeichnis der Repository. Durch den Punkt wird
+    # sie nicht für einen Softwareordner gehalten.
+    filename = '.index'
+
+    # Kennung und Version des Dateiformats.
+    MAGIC = b'SMIX'
+    VERSION = 1
+
+    # Kopf: Kennung, Version, Fingerabdruck der Repository, Anzahl Einträge.
+    HEADER = struct.Struct('<4sH32sI')
+
+    # Tabelleneintrag: Position und Länge von Slug und Daten.
+    ENTRY = struct.Struct('<IHII')
+
+    # Skripte, deren Vorhandensein und Inhalt im Index vermerkt werden.
+    SCRIPTS = ['install.py', 'uninstall.py', 'update.py']
+
+    def __init__(self, repository, data, entries):
+        """
+        Erstellt das Index-Objekt. Sollte nicht direkt, sondern über `open`
+        aufgerufen werden.
+
+        Parameters
+        ----------
+        repository : str
+            Verzeichnis der Repository.
+        data : mmap.mmap
+            Eingeblendeter Inhalt der Indexdatei.
+        entries : dict
+            Position und Länge der Daten je Slug.
+        """
+        self.repository = repository
+        self.data = data
+        self.entries = entries
+
+    @staticmethod
+    def getFile(repository):
+        """
+        Gibt den Pfad zur Indexdatei einer Repository zurück.
+
+        Parameters
+        ----------
+        repository : str
+            Verzeichnis der Repository.
+
+        Returns
+        -------
+        Pfad zur Indexdatei.
+        """
+        return os.path.join(repository, Index.filename)
+
+    @staticmethod
+    def getFingerprint(repository):
+        """
+        Ermittelt den Fingerabdruck einer Repository anhand der Git-Objekte
+        ihrer Einträge im aktuellen Commit. Die Indexdatei selbst wird dabei
+        ausgenommen, damit sie mit committet werden kann. Da sich die
+        Repository nur durch Commits ändern soll, genügt dies; bei lokalen
+        Änderungen gilt der Fingerabdruck als unbekannt.
+
+        Parameters
+        ----------
+        repository : str
+            Verzeichnis der Repository.
+
+        Returns
+        -------
+        SHA-256 des Verzeichnisinhalts als Bytes oder None, falls die
+        Repository nicht in Git liegt oder lokale Änderungen hat.
+        """
+        try:
+            tree = subprocess.check_output(
+                ['git', 'ls-tree', 'HEAD', './'], cwd=repository,
+                stderr=subprocess.DEVNULL)
+            dirty = subprocess.check_output(
+                ['git', 'status', '--porcelain', '--', './',
+                 ':(exclude)' + Index.filename], cwd=repository,
+                stderr=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, OSError):
+            return None
+        if dirty.strip(): return None
+        lines = [line for line in tree.splitlines()
+                 if line.split(b'\t', 1)[-1] != Index.filename.encode()]
+        return hashlib.sha256(b'\n'.join(lines)).digest()
+
+    @staticmethod
+    def build(repository):
+        """
+        Übersetzt eine Repository in ihre Indexdatei.
+
+        Parameters
+        ----------
+        repository : str
+            Verzeichnis der Repository.
+
+        Returns
+        -------
+        Ob der Index beim Start genutzt werden kann. Das ist nicht der Fall,
+        wenn die Repository lokale Änderungen hat oder nicht in Git liegt.
+        """
+        fingerprint = Index.getFingerprint(repository)
+        slugs = []
+        blobs = []
+        for d in sorted(f.path for f in os.scandir(repository) if f.is_dir()):
+            if not os.path.exists(os.path.join(d, 'config.yml')): continue
+            with open(os.path.join(d, 'config.yml'), 'r') as f:
+                config = yaml.full_load(f) or {}
+            scripts = {}
+            for script in Index.SCRIPTS:
+                path = os.path.join(d, script)
+                if not os.path.exists(path): continue
+                with open(path, 'rb') as f:
+                    scripts[script] = hashlib.sha256(f.read()).hexdigest()
+            slugs.append(os.path.basename(d).encode('utf-8'))
+            blobs.append(json.dumps({
+                'name': config.get('name'),
+                'version': config.get('version'),
+                'pip': config.get('pip') or [],
+                'dependencies': config.get('dependencies') or [],
+                'run': config.get('run'),
+                'scripts': scripts,
+                'config': config,
+            }, default=str).encode('utf-8'))
+
+        # Positionen berechnen: Kopf, Tabelle, Slugs, Daten.
+        offset = Index.HEADER.size + Index.ENTRY.size * len(slugs)
+        table = []
+        slugOffsets = []
+        for slug in slugs:
+            slugOffsets.append(offset)
+            offset += len(slug)
+        for slug, slugOffset, blob in zip(slugs, slugOffsets, blobs):
+            table.append(Index.ENTRY.pack(slugOffset, len(slug), offset,
+                                          len(blob)))
+            offset += len(blob)
+
+        # Erst vollständig schreiben, dann atomar ersetzen, damit ein
+        # gleichzeitig startender Manager nie einen halben Index einblendet.
+        path = Index.getFile(repository)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(Index.HEADER.pack(Index.MAGIC, Index.VERSION,
+                                      fingerprint or bytes(32), len(slugs)))
+            f.write(b''.join(table))
+            f.write(b''.join(slugs))
+            f.write(b''.join(blobs))
+        os.replace(path + '.tmp', path)
+        return fingerprint is not None
+
+    @staticmethod
+    def open(repository):
+        """
+        Blendet die Indexdatei einer Repository ein, sofern sie existiert,
+        im richtigen Format vorliegt und zum aktuellen Stand der Repository
+        passt.
+
+        Parameters
+        ----------
+        repository : str
+            Verzeichnis der Repository.
+
+        Returns
+        -------
+        Das Index-Objekt oder None, falls die Repository durchsucht werden
+        muss.
+        """
+        path = Index.getFile(repository)
+        if not os.path.exists(path): return None
+        if os.path.getsize(path) < Index.HEADER.size: return None
+
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, fingerprint, count = \
+            Index.HEADER.unpack_from(data, 0)
+        if magic != Index.MAGIC or version != Index.VERSION \
+                or fingerprint != Index.getFingerprint(repository):
+            data.close()
+            return None
+
+        entries = {}
+        for i in range(count):
+            slugOffset, slugLength, offset, length = Index.ENTRY.unpack_from(
+                data, Index.HEADER.size + i * Index.ENTRY.size)
+            slug = data[slugOffset:slugOffset + slugLength].decode('utf-8')
+            entries[slug] = (offset, length)
+        return Index(repository, data, entries)
+
+    def getSlugs(self):
+        """
+        Gibt die Slugs aller Software im Index zurück.
+
+        Returns
+        -------
+        Liste der Slugs.
+        """
+        return list(self.entries)
+
+    def getEntry(self, slug):
+        """
+        Dekodiert den Eintrag einer Software.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der Software.
+
+        Returns
+        -------
+        Dictionary mit den Schlüsseln `name`, `version`, `pip`,
+        `dependencies`, `run`, `scripts` (Dateiname und SHA-256 vorhandener
+        Skripte) und `config` (vollständige Konfiguration).
+        """
+        offset, length = self.entries[slug]
+        return json.loads(self.data[offset:offset + length].decode('utf-8'))
+
+
+class LazySoftware(MutableMapping):
+    """
+    Dictionary der Software, das die Software-Objekte erst beim ersten Zugriff
+    erstellt. Reihenfolge und Existenz der Slugs sind dagegen von Anfang an
+    bekannt.
+
+    Attributes
+    ----------
+    slugs : dict
+        Slugs als Keys in der Reihenfolge, in der sie durchlaufen werden.
+    factory : func(str)
+        Funktion, die zu einem Slug das Software-Objekt erstellt.
+    software : dict
+        Bereits erstellte Software-Objekte.
+    """
+
+    def __init__(self, slugs, factory):
+        """
+        Erstellt das Dictionary.
+
+        Parameters
+        ----------
+        slugs : list(str)
+            Slugs aller enthaltenen Software.
+        factory : func(str)
+            Funktion, die zu einem Slug das Software-Objekt erstellt.
+        """
+        self.slugs = dict.fromkeys(slugs)
+        self.factory = factory
+        self.software = {}
+
+    def __getitem__(self, slug):
+        if slug not in self.software:
+            if slug not in self.slugs: raise KeyError(slug)
+            self.software[slug] = self.factory(slug)
+        return self.software[slug]
+
+    def __setitem__(self, slug, software):
+        self.slugs[slug] = None
+        self.software[slug] = software
+
+    def __delitem__(self, slug):
+        del self.slugs[slug]
+        self.software.pop(slug, None)
+
+    def __contains__(self, slug):
+        return slug in self.slugs
+
+    def __iter__(self):
+        return iter(list(self.slugs))
+
+    def __len__(self):
+        return len(self.slugs)
@@ -0,0 +1,193 @@
+import json
+import os
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:
+    # Unter Windows gibt es keine rlimits. Die übrigen Beschränkungen werden
+    # dort ebenfalls nicht unterstützt (s. `Limits.getCommand`).
+    resource = None
+
+
+class Limits:
+    """
+    Beschränkungen für die Prozesse automatisch gestarteter Software:
+    CPU-Affinität, Priorität und Ressourcenlimits. Diese werden im Kindprozess
+    noch vor dem Start des eigentlichen Skripts angewendet.
+
+    Attributes
+    ----------
+    config : dict
+        Konfiguration der Software aus der Repository, der die Beschränkungen
+        entnommen werden.
+    """
+
+    # Manager-weite Richtlinie zur Verteilung auf Kerne. Bei `spread` erhält
+    # jede Software ohne eigene Angabe reihum einen eigenen Kern.
+    policy = None
+
+    # Index des nächsten Kerns, der bei automatischer Verteilung vergeben wird.
+    nextCore = 0
+
+    # Sperre für die Vergabe von Kernen.
+    lock = threading.Lock()
+
+    # Programm, das im Kindprozess die als JSON übergebenen Beschränkungen
+    # setzt und sich anschließend durch den eigentlichen Aufruf ersetzt.
+    TRAMPOLINE = '\n'.join([
+        'import json, os, sys',
+        'spec = json.loads(sys.argv[1])',
+        "if spec['cpus'] is not None: os.sched_setaffinity(0, spec['cpus'])",
+        "if spec['nice'] is not None: os.nice(int(spec['nice']))",
+        "if spec['rlimits']: import resource",
+        "for limit, values in spec['rlimits']:",
+        '    resource.setrlimit(limit, tuple(values))',
+        'os.execv(sys.argv[2], sys.argv[2:])',
+    ])
+
+    # Zuordnung der Schlüssel unter `limits` zu den entsprechenden rlimits und
+    # einem Faktor, mit dem der konfigurierte Wert umgerechnet wird.
+    RLIMITS = {
+        'memory': ('RLIMIT_AS', 1024 * 1024),
+        'files': ('RLIMIT_NOFILE', 1),
+        'cputime': ('RLIMIT_CPU', 1),
+    }
+
+    def __init__(self, config):
+        """
+        Erstellt die Beschränkungen anhand der Konfiguration einer Software.
+
+        Parameters
+        ----------
+        config : dict
+            Konfiguration der Software aus der Repository.
+        """
+        self.config = config
+
+    @staticmethod
+    def setPolicy(policy):
+        """
+        Setzt die Manager-weite Richtlinie zur Verteilung auf Kerne.
+
+        Parameters
+        ----------
+        policy : str
+            `spread`, um Software automatisch auf die verfügbaren Kerne zu
+            verteilen, oder None, um darauf zu verzichten.
+        """
+        if policy not in [None, 'spread']:
+            raise ValueError('Unbekannte Verteilungsrichtlinie: %s' % policy)
+        Limits.policy = policy
+
+    @staticmethod
+    def getAvailableCores():
+        """
+        Ermittelt die Kerne, die dem Manager zur Verfügung stehen.
+
+        Returns
+        -------
+        Sortierte Liste der Nummern der verfügbaren Kerne.
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            return sorted(os.sched_getaffinity(0))
+        return list(range(os.cpu_count() or 1))
+
+    @staticmethod
+    def allocateCores(count):
+        """
+        Vergibt reihum die entsprechende Anzahl an Kernen, sodass sich
+        automatisch gestartete Software möglichst gleichmäßig verteilt.
+
+        Parameters
+        ----------
+        count : int
+            Anzahl an Kernen, die vergeben werden sollen.
+
+        Returns
+        -------
+        Liste der Nummern der vergebenen Kerne.
+        """
+        cores = Limits.getAvailableCores()
+        count = max(1, min(count, len(cores)))
+        with Limits.lock:
+            start = Limits.nextCore
+            Limits.nextCore = (start + count) % len(cores)
+        return [cores[(start + i) % len(cores)] for i in range(count)]
+
+    def getCpus(self):
+        """
+        Ermittelt die Kerne, auf die die Software beschränkt werden soll. Eine
+        explizite Liste unter `cpus` hat Vorrang vor einer Anzahl unter
+        `cores`, diese wiederum vor der Manager-weiten Richtlinie.
+
+        Returns
+        -------
+        Liste der Nummern der Kerne oder None, falls keine Beschränkung
+        vorgesehen ist.
+        """
+        if self.config.get('cpus') is not None:
+            return list(self.config.get('cpus'))
+        if self.config.get('cores') is not None:
+            return Limits.allocateCores(int(self.config.get('cores')))
+        if Limits.policy == 'spread': return Limits.allocateCores(1)
+        return None
+
+    def getRlimits(self):
+        """
+        Ermittelt die zu setzenden Ressourcenlimits.
+
+        Returns
+        -------
+        Liste von Tupeln aus rlimit-Konstante und dem Paar aus weichem und
+        hartem Limit. Das harte Limit des Managers wird dabei nie
+        überschritten.
+        """
+        limits = self.config.get('limits') or {}
+        unknown = set(limits) - set(Limits.RLIMITS)
+        if unknown:
+            raise ValueError('Unbekannte Limits: %s' % ', '.join(unknown))
+        if resource is None: return []
+
+        rlimits = []
+        for key, value in limits.items():
+            name, factor = Limits.RLIMITS[key]
+            limit = getattr(resource, name)
+            _, hard = resource.getrlimit(limit)
+            value = int(value * factor)
+            if hard != resource.RLIM_INFINITY: value = min(value, hard)
+            rlimits.append((limit, (value, value)))
+        return rlimits
+
+    def getCommand(self, args):
+        """
+        Ergänzt einen Aufruf so, dass alle Beschränkungen im Kindprozess vor
+        dem Start des eigentlichen Programms gesetzt werden. Statt per
+        `preexec_fn`, das bei Starts aus mehreren Threads heraus zu Deadlocks
+        im Kindprozess führen kann, geschieht dies über ein kurzes
+        Python-Programm, das die Beschränkungen setzt und sich dann per `exec`
+        durch den eigentlichen Aufruf ersetzt.
+
+        Parameters
+        ----------
+        args : list(str)
+            Aufruf des Programms samt Parametern.
+
+        Returns
+        -------
+        Der ergänzte Aufruf oder der unveränderte, falls nichts zu beschränken
+        ist oder das Betriebssystem dies nicht unterstützt.
+        """
+        if os.name != 'posix': return args
+        cpus = self.getCpus()
+        if not hasattr(os, 'sched_setaffinity'): cpus = None
+        nice = self.config.get('nice')
+        rlimits = self.getRlimits()
+        if cpus is None and nice is None and not rlimits: return args
+
+        spec = json.dumps({'cpus': cpus, 'nice': nice, 'rlimits': rlimits})
+        # Ohne `site` (-S) und isoliert (-I), damit vor den Beschränkungen
+        # nichts aus der Umgebung geladen wird.
+        return [sys.executable, '-I', '-S', '-c', Limits.TRAMPOLINE, spec] \
+            + list(args)
@@ -2,12 +2,27 @@ import os
 import subprocess
 import sys
 
+from profiler import Profiler
+from sync import Sync
+
 
 # Startet das eigentliche Skript nachdem die Repository geupdated wurde.
 def main():
     dir = os.path.dirname(os.path.abspath(__file__))
-    subprocess.check_call(['git', 'pull'], cwd=dir)
-    subprocess.check_call([sys.executable, 'SoftwareManager.py'], cwd=dir)
+    # Bei einer Profilierung soll auch diese Aktualisierung im Bericht
+    # auftauchen; die Messung wird dazu an den Manager übergeben.
+    profile = Profiler.isRequested(sys.argv[1:])
+    if profile: Profiler.record()
+    sync = Sync(dir)
+    sync.update()
+
+    # Teilt dem Manager mit, dass diese Arbeitskopie bereits aktuell ist, damit
+    # er sie nicht erneut aktualisiert, falls die Repository in ihr liegt.
+    env = dict(os.environ)
+    if sync.root is not None: env[Sync.ENV] = sync.root
+    if profile: env[Profiler.ENVSPANS] = Profiler.getSpanEnv()
+    subprocess.check_call([sys.executable, 'SoftwareManager.py']
+                          + sys.argv[1:], cwd=dir, env=env)
 
 
 if __name__ == '__main__':
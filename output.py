@@ -1,11 +1,20 @@
 from colorama import Fore, Style
 import colorama
+import csv
+from datetime import datetime, timedelta
 import os
-import subprocess
 
+from autostart import Autostart
 from config import Config
 from database import Database
+from environment import Environment
+from index import Index
+from limits import Limits
+from policy import Policy, ScriptTimeout
+from removal import Removal
+from sampler import Sampler
 from software import Software
+from sync import Sync
 
 """
 Zusammenfassung von Funktionen, die sich mit der Ausgabe von Informationen auf
@@ -64,11 +73,42 @@ def loadSoftware():
     # Installationen (Target) befinden.
     config.checkParams('repository', 'target')
     Software.setTargetDir(config.get('target'))
+    # Optional: Verzeichnis, in dem jede Software eine eigene virtuelle
+    # Umgebung erhält. Ohne diesen Parameter teilen sich alle den Interpreter
+    # des Managers.
+    Environment.setBaseDir(config.get('environments'))
+    # Optional: Richtlinie, nach der automatisch gestartete Software auf die
+    # verfügbaren Kerne verteilt wird.
+    Limits.setPolicy(config.get('affinity'))
+    # Optional: Wie viel Software gleichzeitig gestartet werden darf.
+    Autostart.setConcurrency(config.get('autostartConcurrency'))
+    # Optional: Wie viel veraltete Software gleichzeitig entfernt werden darf.
+    Removal.setConcurrency(config.get('removalConcurrency'))
+    # Optional: Wie oft und mit welcher Wartezeit vorübergehende Fehler
+    # wiederholt werden sowie die standardmäßige Zeitbegrenzung von Skripten.
+    Policy.configure(config.get('retries'), config.get('retryBackoff'),
+                     config.get('retryBackoffMax'), config.get('timeout'))
+    # Optional: Abstand und Anzahl der Messungen des Ressourcenverbrauchs.
+    Sampler.configure(config.get('sampleInterval'), config.get('sampleSize'))
+    # Optional: Zeitbegrenzung und Tiefe beim Aktualisieren der Repository.
+    Sync.configure(config.get('syncTimeout'), config.get('syncDepth'))
     print(Fore.GREEN + 'Ok' + Style.RESET_ALL)
 
-    # Repository aktualisieren
-    print('Aktualisiere Repository…')
-    subprocess.check_call(['git', 'pull'], cwd=config.get('repository'))
+    # Repository aktualisieren, sofern sie nicht in der bereits von `main.py`
+    # aktualisierten Arbeitskopie liegt. Eine eigene Arbeitskopie wird dabei
+    # auf das Verzeichnis der Repository beschränkt – nicht aber die des
+    # Managers selbst.
+    sync = Sync(config.get('repository'))
+    if sync.isSynced():
+        print('Repository ist bereits aktuell.')
+    else:
+        print('Aktualisiere Repository: ', end='')
+        manager = os.path.dirname(os.path.abspath(__file__))
+        if sync.update(sparse=not sync.contains(manager)):
+            print(Fore.GREEN + 'Ok' + Style.RESET_ALL)
+        else:
+            print(Fore.YELLOW + 'Nicht möglich, nutze letzten Stand'
+                  + Style.RESET_ALL)
 
     # Nun die Software einlesen
     print('Lese Software ein: ', end='')
@@ -82,6 +122,21 @@ def loadSoftware():
     print()
 
 
+def buildIndex():
+    """
+    Übersetzt die konfigurierte Repository in ihren Index, der beim Start
+    statt einer Durchsuchung der Repository genutzt wird.
+    """
+    config = Config()
+    config.checkParams('repository')
+    print('Erstelle Index: ', end='')
+    if Index.build(config.get('repository')):
+        print(Fore.GREEN + 'Ok' + Style.RESET_ALL)
+    else:
+        print(Fore.YELLOW + 'Ok, wird aber erst nach einem Commit aller '
+              'Änderungen genutzt' + Style.RESET_ALL)
+
+
 def updateSoftware(software):
     """
     Reagiert auf die Statusänderung einer Software mit einer entsprechenden
@@ -96,7 +151,6 @@ def updateSoftware(software):
     print(software.getName() + ': ' + getSoftwareState(software))
     if software.hasError():
         print(Fore.RED + software.error_msg + Style.RESET_ALL)
-        exit()
 
 
 def printSoftwareTable():
@@ -138,8 +192,10 @@ def getSoftwareState(software):
         Software.INSTALLED: 'Installiert',
         Software.UPDATING: 'Aktualisiere…',
         Software.UPDATED: 'Aktualisiert',
+        Software.STARTING: 'Starte…',
         Software.AUTOSTARTED: 'Automatisch gestartet',
         Software.ERROR: 'FEHLER',
+        Software.TIMEOUT: 'ZEITÜBERSCHREITUNG',
     }
 
     state = names[software.state]
@@ -157,11 +213,20 @@ def startInstalls():
     software = [s for _, s in Database.software.items() if not s.isInstalled()]
     if len(software) < 1: return
 
+    # Reihenfolge nach kritischem Pfad festlegen, damit die längsten
+    # Abhängigkeitsketten zuerst an die Reihe kommen.
+    def estimate(s):
+        return Database.getEstimate(s.slug, 'pip') \
+            + Database.getEstimate(s.slug, 'install')
+    software = Database.getSchedule(software, estimate)
+
     # Ausgabe einer kurzen Information und Installation aller betroffenen
     # Software.
     print()
     print('{:*^80}'.format(' Starte Installationen… '))
-    for s in software: s.install()
+    for i, s in enumerate(software):
+        printEta(i, len(software), sum(map(estimate, software[i:])))
+        s.install()
     print('{:*^80}'.format(' Installationen abgeschlossen '))
 
     # Softwaretabelle nachher noch einmal ausgeben.
@@ -175,11 +240,56 @@ def startUpdates():
     print()
     print('{:*^80}'.format(' Starte Aktualisierungen… '))
     print(Fore.BLUE + 'Überprüfe einzelne Einträge…' + Style.RESET_ALL)
-    Database.updateSoftware()
+    versions = Database.getUpdatableSoftware()
+
+    def estimate(s):
+        return Database.getEstimate(s.slug, 'update')
+    software = Database.getSchedule(list(versions), estimate)
+
+    for i, s in enumerate(software):
+        printEta(i, len(software), sum(map(estimate, software[i:])))
+        s.update(versions[s])
     print('{:*^80}'.format(' Aktualisierungen abgeschlossen '))
     printSoftwareTable()
 
 
+def printEta(done, total, remaining):
+    """
+    Gibt den Fortschritt einer Reihe von Vorgängen samt voraussichtlicher
+    Restdauer aus.
+
+    Parameters
+    ----------
+    done : int
+        Anzahl bereits abgeschlossener Vorgänge.
+    total : int
+        Anzahl aller Vorgänge.
+    remaining : float
+        Geschätzte Restdauer in Sekunden.
+    """
+    eta = datetime.now() + timedelta(seconds=remaining)
+    print(Fore.BLUE + '[{}/{}] Restdauer ca. {}:{:02d} min (fertig gegen {})'
+          .format(done, total, int(remaining // 60), int(remaining % 60),
+                  eta.strftime('%H:%M:%S')) + Style.RESET_ALL)
+
+
+def exportStatistics(file):
+    """
+    Schreibt die Statistiken über die Dauer vergangener Phasen je Software
+    als CSV, etwa für die Kapazitätsplanung.
+
+    Parameters
+    ----------
+    file : file
+        Geöffnete Datei, in die geschrieben werden soll.
+    """
+    fields = ['slug', 'phase', 'count', 'median', 'mean', 'min', 'max',
+              'last']
+    writer = csv.DictWriter(file, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(Database.getStatistics())
+
+
 def uninstallOldSoftware():
     """
     Lässt Software löschen, die aus der Repository entfernt wurde.
@@ -189,13 +299,23 @@ def uninstallOldSoftware():
 
     print()
     print('{:*^80}'.format(' Entferne veraltete Software… '))
-    for s in slugs:
-        print(Fore.BLUE + 'Software %s wird entfernt…' % s + Style.RESET_ALL)
-        if not Database.isSlugSafeToUninstall(s):
-            print(Fore.RED + 'FEHLER: Software wird noch in Abhängigkeiten '
-                  'geführt!' + Style.RESET_ALL)
-            exit()
-        Database.uninstallOldSlug(s)
+    print(Fore.BLUE + 'Software wird entfernt: %s' % ', '.join(sorted(slugs))
+          + Style.RESET_ALL)
+
+    def report(slug, error):
+        if error is None:
+            print('Software %s: ' % slug + Fore.GREEN + 'Entfernt'
+                  + Style.RESET_ALL)
+            Database.clearError(slug)
+            return
+        # Die Software verbleibt in der Datenbank und wird beim nächsten Lauf
+        # erneut entfernt; der Rest läuft unabhängig davon weiter.
+        print('Software %s: ' % slug + Fore.RED + 'FEHLER: %s' % error
+              + Style.RESET_ALL)
+        Database.recordError(slug, str(error),
+                             isinstance(error, ScriptTimeout))
+
+    Removal.run(slugs, report)
     print('{:*^80}'.format(' Veraltete Software entfernt. '))
     printSoftwareTable()
 
@@ -211,13 +331,90 @@ def autostartSoftware():
     print(Fore.GREEN + 'ok' + Style.RESET_ALL)
 
     startableSoftware = [s for s in Database.software.values()
-                         if s.isRunnable()]
+                         if s.isRunnable() and s.isInstalled()]
     if len(startableSoftware) < 1:
         print(Fore.BLUE + 'Keine automatisch startende Software vorhanden.'
               + Style.RESET_ALL)
 
-    for s in startableSoftware:
-        print('Starte ' + s.getName() + '…')
-        s.run()
+    # Die Software wird in Abhängigkeitsreihenfolge und nur begrenzt
+    # gleichzeitig gestartet; den Fortschritt meldet `updateSoftware`.
+    Autostart.start(startableSoftware)
 
     print('{:*^80}'.format(' Software gestartet '))
+
+
+def startSampler():
+    """
+    Startet die Messung des Ressourcenverbrauchs der automatisch gestarteten
+    Software.
+
+    Returns
+    -------
+    Den laufenden `Sampler` oder None, falls nicht gemessen werden kann.
+    """
+    software = [s for s in Database.software.values()
+                if s.process is not None]
+    if len(software) < 1 or not Sampler.isSupported(): return None
+    sampler = Sampler(software)
+    sampler.start()
+    return sampler
+
+
+def stopSampler(sampler):
+    """
+    Beendet die Messung des Ressourcenverbrauchs und sichert die Messungen.
+
+    Parameters
+    ----------
+    sampler : Sampler
+        Der laufende `Sampler` oder None.
+    """
+    if sampler is None: return
+    print('Sichere Messungen… ', end='')
+    sampler.stop()
+    print(Fore.GREEN + 'Ok' + Style.RESET_ALL)
+
+
+def printUsage():
+    """
+    Gibt eine Tabelle mit dem gemessenen Ressourcenverbrauch aller Software
+    aus, für die Messungen gesichert wurden.
+    """
+    slugs = []
+    if os.path.isdir(Software.dirLog):
+        slugs = sorted(f.name for f in os.scandir(Software.dirLog)
+                       if os.path.exists(Sampler.getFile(f.name)))
+
+    print('{:^38}'.format('Software') + '|{:^9}|{:^9}|{:^9}|{:^12}'
+          .format('Messungen', 'CPU p50', 'CPU p95', 'RSS max'))
+    print('-' * 38 + ('|' + '-' * 9) * 3 + '|' + '-' * 12)
+    for slug in slugs:
+        summary = Sampler.summarize(Sampler.load(slug))
+        if summary is None: continue
+        print(' {:<37}|{:>8} |{:>7.1f}% |{:>7.1f}% |{:>8.1f} MiB'.format(
+            slug, summary['count'], summary['cpu50'], summary['cpu95'],
+            summary['rssPeak'] / 1024 / 1024))
+
+
+def printSummary():
+    """
+    Gibt eine Zusammenfassung aller Fehler des aktuellen Laufs aus.
+
+    Returns
+    -------
+    Ob der Lauf fehlerfrei war.
+    """
+    errors = Database.getCurrentErrors()
+    print()
+    if len(errors) < 1:
+        print(Fore.GREEN + 'Alle Vorgänge erfolgreich abgeschlossen.'
+              + Style.RESET_ALL)
+        return True
+
+    print(Fore.RED + '{:*^80}'.format(' %d Fehler ' % len(errors))
+          + Style.RESET_ALL)
+    for slug, reason in sorted(errors.items()):
+        software = Database.software.get(slug)
+        name = software.getName() if software is not None else slug
+        print(' ' + name + ': ' + Fore.RED + reason + Style.RESET_ALL)
+    return False
@@ -0,0 +1,235 @@
+import os
+import signal
+import subprocess
+import time
+
+from profiler import Profiler
+
+
+class ScriptError(Exception):
+    """
+    Fehler beim Ausführen eines externen Skripts oder Programms, der auch nach
+    allen Wiederholungen bestehen bleibt.
+    """
+    pass
+
+
+class ScriptTimeout(ScriptError):
+    """
+    Ein Skript hat seine Zeitbegrenzung überschritten und wurde samt aller
+    von ihm gestarteten Prozesse beendet.
+    """
+    pass
+
+
+class Policy:
+    """
+    Richtlinie zur Ausführung externer Skripte und Programme. Schlägt ein
+    Aufruf vorübergehend fehl, wird er mit exponentiell wachsender, aber
+    gedeckelter Wartezeit wiederholt. Bleibende Fehler werden als
+    `ScriptError` gemeldet, damit nur die betroffene Software und nicht der
+    gesamte Lauf abgebrochen wird.
+    """
+
+    # Anzahl an Wiederholungen nach dem ersten fehlgeschlagenen Versuch.
+    retries = 2
+
+    # Wartezeit in Sekunden vor der ersten Wiederholung; verdoppelt sich mit
+    # jedem weiteren Versuch.
+    backoff = 1
+
+    # Obergrenze der Wartezeit in Sekunden.
+    backoffMax = 30
+
+    # Standardmäßige Zeitbegrenzung eines Aufrufs in Sekunden. Bei None oder
+    # Werten kleiner gleich 0 wird nicht begrenzt.
+    timeout = 3600
+
+    # Sekunden zwischen SIGTERM und SIGKILL, wenn ein Aufruf wegen
+    # Zeitüberschreitung beendet wird.
+    killGrace = 10
+
+    # Rückgabewerte, mit denen ein Skript einen vorübergehenden Fehler meldet
+    # (EX_TEMPFAIL nach sysexits.h).
+    transientCodes = [75]
+
+    @staticmethod
+    def configure(retries=None, backoff=None, backoffMax=None,
+                  timeout=None):
+        """
+        Passt die Richtlinie an. Nicht angegebene Werte bleiben unverändert.
+
+        Parameters
+        ----------
+        retries : int
+            Anzahl an Wiederholungen.
+        backoff : float
+            Wartezeit vor der ersten Wiederholung in Sekunden.
+        backoffMax : float
+            Obergrenze der Wartezeit in Sekunden.
+        timeout : float
+            Standardmäßige Zeitbegrenzung eines Aufrufs in Sekunden.
+        """
+        if retries is not None: Policy.retries = int(retries)
+        if backoff is not None: Policy.backoff = float(backoff)
+        if backoffMax is not None: Policy.backoffMax = float(backoffMax)
+        if timeout is not None: Policy.timeout = float(timeout)
+
+    @staticmethod
+    def getDelay(attempt):
+        """
+        Ermittelt die Wartezeit vor einer Wiederholung.
+
+        Parameters
+        ----------
+        attempt : int
+            Nummer des fehlgeschlagenen Versuchs, beginnend bei 0.
+
+        Returns
+        -------
+        Wartezeit in Sekunden.
+        """
+        return min(Policy.backoffMax, Policy.backoff * 2 ** attempt)
+
+    @staticmethod
+    def describe(args):
+        """
+        Erstellt eine kurze, lesbare Bezeichnung eines Aufrufs für
+        Fehlermeldungen.
+
+        Parameters
+        ----------
+        args : list(str)
+            Aufruf des Programms samt Parametern.
+
+        Returns
+        -------
+        Programmname ohne Pfad mit den ersten beiden Parametern.
+        """
+        return ' '.join([os.path.basename(args[0])] + list(args[1:3]))
+
+    @staticmethod
+    def call(args, cwd=None, transient=False, capture=False, timeout=None):
+        """
+        Führt ein Programm aus und wiederholt es bei vorübergehenden Fehlern.
+        Überschreitet es seine Zeitbegrenzung, wird es nicht wiederholt, da
+        ein hängendes Skript erfahrungsgemäß erneut hängt.
+
+        Parameters
+        ----------
+        args : list(str)
+            Aufruf des Programms samt Parametern.
+        cwd : str
+            Ausführungsverzeichnis.
+        transient : bool
+            Ob jeder Fehler als vorübergehend gilt, etwa bei Netzwerkzugriffen
+            durch PIP. Andernfalls gelten nur die `transientCodes` als
+            vorübergehend.
+        capture : bool
+            Ob die Standardausgabe zurückgegeben werden soll.
+        timeout : float
+            Zeitbegrenzung je Versuch in Sekunden. Bei None gilt die
+            standardmäßige Zeitbegrenzung.
+
+        Returns
+        -------
+        Die Standardausgabe, sofern `capture` gesetzt ist, ansonsten None.
+        """
+        if timeout is None: timeout = Policy.timeout
+        if timeout is not None and timeout <= 0: timeout = None
+
+        attempt = 0
+        while True:
+            try:
+                return Policy.execute(args, cwd, capture, timeout)
+            except subprocess.CalledProcessError as e:
+                retry = transient or e.returncode in Policy.transientCodes
+                if not retry or attempt >= Policy.retries:
+                    raise ScriptError('%s ist mit Code %d fehlgeschlagen.'
+                                      % (Policy.describe(args), e.returncode))
+            except OSError as e:
+                raise ScriptError('%s konnte nicht ausgeführt werden: %s'
+                                  % (args[0], e))
+            time.sleep(Policy.getDelay(attempt))
+            attempt += 1
+
+    @staticmethod
+    def execute(args, cwd, capture, timeout):
+        """
+        Führt ein Programm einmalig in einer eigenen Prozessgruppe aus. So
+        können bei Zeitüberschreitung oder Abbruch des Managers auch alle von
+        ihm gestarteten Prozesse beendet werden.
+
+        Parameters
+        ----------
+        args : list(str)
+            Aufruf des Programms samt Parametern.
+        cwd : str
+            Ausführungsverzeichnis.
+        capture : bool
+            Ob die Standardausgabe zurückgegeben werden soll.
+        timeout : float
+            Zeitbegrenzung in Sekunden oder None.
+
+        Returns
+        -------
+        Die Standardausgabe, sofern `capture` gesetzt ist, ansonsten None.
+        """
+        if os.name == 'posix': group = {'start_new_session': True}
+        else: group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+        with Profiler.span(args):
+            process = subprocess.Popen(
+                args, cwd=cwd, stdout=subprocess.PIPE if capture else None,
+                **group)
+            try:
+                output, _ = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                Policy.kill(process)
+                raise ScriptTimeout('%s hat die Zeitbegrenzung von %d s '
+                                    'überschritten.'
+                                    % (Policy.describe(args), timeout))
+            except BaseException:
+                # Etwa bei KeyboardInterrupt: Die eigene Prozessgruppe erreicht
+                # das Signal nicht, daher muss sie hier beendet werden.
+                Policy.kill(process)
+                raise
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args,
+                                                output)
+        return output
+
+    @staticmethod
+    def kill(process):
+        """
+        Beendet einen Prozess samt seiner Prozessgruppe: zunächst höflich per
+        SIGTERM und nach `killGrace` Sekunden endgültig per SIGKILL. SIGKILL
+        wird dabei in jedem Fall an die Gruppe gesendet, um auch Enkelprozesse
+        zu erwischen, die SIGTERM ignorieren.
+
+        Parameters
+        ----------
+        process : subprocess.Popen
+            Der zu beendende Prozess, der eine eigene Prozessgruppe anführt.
+        """
+        if os.name != 'posix':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+            process.wait()
+            return
+
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        try:
+            process.wait(timeout=Policy.killGrace)
+        except subprocess.TimeoutExpired:
+            pass
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
@@ -0,0 +1,476 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import pstats
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+class Profiler:
+    """
+    Profilierung des Starts des Managers, also von seinem Aufruf bis zum
+    Beginn der Überwachung automatisch gestarteter Software. Er wird dazu
+    mit `-X importtime` in einem eigenen Prozess neu gestartet, der sich
+    selbst per cProfile profiliert und die Dauer jedes Aufrufs externer
+    Programme (PIP, Skripte der Software, Git) samt zugehörigem Slug und Phase
+    festhält. Nach dessen Ende fasst der aufrufende Prozess alles in einer
+    Datei mit gefalteten Stacks (für Flamegraphs) und einer Tabelle der
+    teuersten Einträge zusammen.
+
+    Die Stacks beginnen mit `manager` (Funktionen des Managers), `imports`
+    (Importe vor dem Start der Profilierung) oder `children` (externe
+    Programme je Slug und Phase); Werte sind in Mikrosekunden. Da externe
+    Programme parallel laufen können, kann ihre Summe die Dauer des Starts
+    übersteigen.
+    """
+
+    # Umgebungsvariable, über die der neu gestartete Manager das Verzeichnis
+    # für die Rohdaten erhält.
+    ENV = 'SOFTWAREMANAGER_PROFILE'
+
+    # Dateien im Profilverzeichnis.
+    fileStats = 'manager.pstats'
+    fileSpans = 'spans.json'
+    fileFolded = 'profile.folded'
+    fileReport = 'profile.txt'
+
+    # Anzahl an Einträgen je Tabelle im Bericht.
+    top = 25
+
+    # Stacks mit weniger Sekunden werden beim Aufteilen auf Aufrufpfade
+    # verworfen, damit deren Anzahl überschaubar bleibt.
+    minTime = 1e-5
+
+    # Umgebungsvariable, über die `main.py` dem Manager die bereits
+    # gemessenen Aufrufe (etwa Git) übergibt.
+    ENVSPANS = 'SOFTWAREMANAGER_PROFILE_SPANS'
+
+    # Ob in diesem Prozess profiliert wird.
+    enabled = False
+
+    # Ob Aufrufe externer Programme gemessen werden.
+    recording = False
+
+    # Gemessene Aufrufe externer Programme als Tupel aus Slug, Phase, Programm
+    # und Dauer in Sekunden.
+    spans = []
+    lock = threading.Lock()
+
+    # Slug und Phase, denen Aufrufe im aktuellen Thread zugeordnet werden.
+    context = threading.local()
+
+    # cProfile-Objekte des Haupt- und aller weiteren Threads.
+    profiles = []
+    started = None
+
+    @staticmethod
+    def isChild():
+        """
+        Ermittelt, ob dies der neu gestartete, zu profilierende Manager ist.
+
+        Returns
+        -------
+        Ob das Profilverzeichnis über die Umgebung übergeben wurde.
+        """
+        return Profiler.ENV in os.environ
+
+    @staticmethod
+    def launch(script, argv, directory):
+        """
+        Startet den Manager mit `-X importtime` neu, wartet auf sein Ende und
+        erstellt anschließend den Bericht. Abbrüche per Strg+C erreichen nur
+        den neu gestarteten Manager, damit dieser seine Daten sichern kann.
+
+        Parameters
+        ----------
+        script : str
+            Pfad zum Skript des Managers.
+        argv : list(str)
+            Parameter, mit denen der Manager gestartet wurde.
+        directory : str
+            Verzeichnis, in dem Rohdaten und Bericht abgelegt werden.
+
+        Returns
+        -------
+        Rückgabewert des neu gestarteten Managers.
+        """
+        directory = os.path.abspath(directory)
+        os.makedirs(directory, exist_ok=True)
+        for f in [Profiler.fileStats, Profiler.fileSpans]:
+            if os.path.exists(os.path.join(directory, f)):
+                os.remove(os.path.join(directory, f))
+
+        env = dict(os.environ)
+        env[Profiler.ENV] = directory
+        process = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', script] + list(argv),
+            env=env, stderr=subprocess.PIPE)
+        handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        imports = []
+        try:
+            # Die Importzeiten landen in der Fehlerausgabe; alles andere wird
+            # unverändert weitergereicht.
+            for line in process.stderr:
+                line = line.decode('utf-8', errors='replace')
+                if line.startswith('import time:'): imports.append(line)
+                else: sys.stderr.write(line)
+            process.wait()
+        finally:
+            signal.signal(signal.SIGINT, handler)
+
+        Profiler.report(directory, imports)
+        print('Profil gespeichert in %s' % directory)
+        return process.returncode
+
+    @staticmethod
+    def isRequested(argv):
+        """
+        Ermittelt ohne vollständiges Parsen, ob die Parameter des Managers eine
+        Profilierung verlangen.
+
+        Parameters
+        ----------
+        argv : list(str)
+            Parameter, mit denen der Manager gestartet werden soll.
+
+        Returns
+        -------
+        Ob `--profile` angegeben ist.
+        """
+        return any(arg == '--profile' or arg.startswith('--profile=')
+                   for arg in argv)
+
+    @staticmethod
+    def record():
+        """
+        Misst nur die Aufrufe externer Programme, ohne den Prozess selbst zu
+        profilieren. Dient `main.py`, um seine Aktualisierung per Git an den
+        Manager weiterzureichen (s. `getSpanEnv`).
+        """
+        Profiler.recording = True
+
+    @staticmethod
+    def getSpanEnv():
+        """
+        Gibt die bisher gemessenen Aufrufe in der Form zurück, in der sie der
+        Manager über `ENVSPANS` beim Start der Profilierung übernimmt.
+
+        Returns
+        -------
+        Die Aufrufe als JSON.
+        """
+        with Profiler.lock:
+            return json.dumps(Profiler.spans)
+
+    @staticmethod
+    def start():
+        """
+        Beginnt die Profilierung des aktuellen Prozesses. Threads, die danach
+        gestartet werden, erhalten ein eigenes cProfile-Objekt.
+        """
+        Profiler.enabled = True
+        Profiler.recording = True
+        Profiler.started = time.perf_counter()
+        Profiler.spans = [tuple(span) for span in
+                          json.loads(os.environ.get(Profiler.ENVSPANS, '[]'))]
+        profile = cProfile.Profile()
+        Profiler.profiles.append(profile)
+        threading.setprofile(Profiler.startThread)
+        profile.enable()
+
+    @staticmethod
+    def startThread(frame, event, arg):
+        """
+        Wird beim ersten Ereignis eines neuen Threads aufgerufen und ersetzt
+        sich dort durch ein eigenes cProfile-Objekt. Ab Python 3.12 erfasst
+        das cProfile-Objekt des Hauptthreads bereits alle Threads; dann wird
+        nur dieser Aufruf beendet.
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            sys.setprofile(None)
+            return
+        with Profiler.lock:
+            Profiler.profiles.append(profile)
+
+    @staticmethod
+    def stop():
+        """
+        Beendet die Profilierung und sichert die Rohdaten im Profilverzeichnis,
+        sofern profiliert wird.
+        """
+        if not Profiler.enabled: return
+        threading.setprofile(None)
+        Profiler.profiles[0].disable()
+        Profiler.enabled = False
+        Profiler.recording = False
+        wall = time.perf_counter() - Profiler.started
+
+        directory = os.environ[Profiler.ENV]
+        with Profiler.lock:
+            stats = pstats.Stats(Profiler.profiles[0])
+            for profile in Profiler.profiles[1:]:
+                try:
+                    stats.add(profile)
+                except TypeError:
+                    # Der Thread hat nichts Messbares ausgeführt.
+                    pass
+            spans = list(Profiler.spans)
+        stats.dump_stats(os.path.join(directory, Profiler.fileStats))
+        with open(os.path.join(directory, Profiler.fileSpans), 'w') as f:
+            json.dump({'wall': wall, 'spans': spans}, f)
+
+    @staticmethod
+    @contextmanager
+    def attribute(slug, phase):
+        """
+        Ordnet alle Aufrufe externer Programme innerhalb des Blocks einer
+        Software und Phase zu. Verschachtelte Blöcke stellen die vorherige
+        Zuordnung danach wieder her.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der Software oder None für den Manager selbst.
+        phase : str
+            Phase, etwa `pip`, `install`, `update`, `uninstall` oder `sync`.
+        """
+        previous = getattr(Profiler.context, 'current', (None, None))
+        Profiler.context.current = (slug, phase)
+        try:
+            yield
+        finally:
+            Profiler.context.current = previous
+
+    @staticmethod
+    @contextmanager
+    def span(args):
+        """
+        Misst die Dauer eines Aufrufs eines externen Programms, sofern
+        profiliert wird.
+
+        Parameters
+        ----------
+        args : list(str)
+            Aufruf des Programms samt Parametern.
+        """
+        if not Profiler.recording:
+            yield
+            return
+        slug, phase = getattr(Profiler.context, 'current', (None, None))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            with Profiler.lock:
+                Profiler.spans.append((slug, phase, Profiler.getProgram(args),
+                                       duration))
+
+    @staticmethod
+    def getProgram(args):
+        """
+        Ermittelt eine kurze Bezeichnung eines Aufrufs, die als Frame in den
+        Stacks dient.
+
+        Parameters
+        ----------
+        args : list(str)
+            Aufruf des Programms samt Parametern.
+
+        Returns
+        -------
+        Etwa `pip install`, `install.py` oder `git fetch`.
+        """
+        name = os.path.basename(args[0])
+        rest = list(args[1:])
+        if rest[:1] == ['-m']: return ' '.join(rest[1:3])
+        if name.startswith('python') and rest:
+            return os.path.basename(rest[0])
+        if name.startswith('git') and rest: return 'git ' + rest[0]
+        return name
+
+    @staticmethod
+    def getName(func):
+        """
+        Erstellt die Bezeichnung einer Funktion aus pstats als Frame.
+
+        Parameters
+        ----------
+        func : tuple
+            Tupel aus Dateiname, Zeile und Funktionsname.
+
+        Returns
+        -------
+        Bezeichnung ohne Semikolons.
+        """
+        filename, line, name = func
+        if filename == '~': label = name
+        else: label = '%s:%d(%s)' % (os.path.basename(filename), line, name)
+        return label.replace(';', ',')
+
+    @staticmethod
+    def getStacks(stats):
+        """
+        Rekonstruiert aus dem Aufrufgraphen von pstats Stacks mit ihrer
+        Eigenzeit. pstats kennt nur direkte Aufrufer, daher wird die Zeit
+        einer Funktion anteilig nach der Gesamtzeit je Aufrufer auf die
+        Aufrufpfade verteilt. Rekursive Aufrufe werden dem äußersten Aufruf
+        zugeschlagen.
+
+        Parameters
+        ----------
+        stats : dict
+            `stats`-Attribut eines `pstats.Stats`-Objekts.
+
+        Returns
+        -------
+        Dictionary mit Tupeln von Frames als Key und Eigenzeit in Sekunden als
+        Value.
+        """
+        callees = {}
+        for func, (_, _, _, _, callers) in stats.items():
+            for caller, (_, _, _, ct) in callers.items():
+                callees.setdefault(caller, {})[func] = ct
+
+        stacks = {}
+        pending = [((func,), 1.0) for func, entry in stats.items()
+                   if not entry[4]]
+        while pending:
+            path, share = pending.pop()
+            func = path[-1]
+            tt = stats[func][2] * share
+            if tt > 0:
+                key = tuple(Profiler.getName(f) for f in path)
+                stacks[key] = stacks.get(key, 0) + tt
+            for callee, ct in callees.get(func, {}).items():
+                total = stats[callee][3]
+                if callee in path or total <= 0: continue
+                if share * ct < Profiler.minTime: continue
+                pending.append((path + (callee,), share * ct / total))
+        return stacks
+
+    @staticmethod
+    def parseImports(lines):
+        """
+        Liest die Ausgabe von `-X importtime` ein. Diese listet Module nach
+        Abschluss ihres Imports, also verschachtelte Importe vor dem
+        importierenden Modul, und rückt sie nach Tiefe ein.
+
+        Parameters
+        ----------
+        lines : list(str)
+            Zeilen der Form `import time: <eigen> | <gesamt> | <modul>`.
+
+        Returns
+        -------
+        Liste von Tupeln aus Stack (Tupel von Modulnamen), Eigenzeit und
+        Gesamtzeit in Mikrosekunden.
+        """
+        imports = []
+        stack = []
+        for line in reversed(lines):
+            parts = line[len('import time:'):].split('|')
+            if len(parts) != 3 or not parts[0].strip().isdigit(): continue
+            name = parts[2].rstrip('\n')
+            depth = len(name) - len(name.lstrip())
+            while stack and stack[-1][0] >= depth: stack.pop()
+            stack.append((depth, name.strip()))
+            imports.append((tuple(n for _, n in stack), int(parts[0]),
+                            int(parts[1])))
+        return imports
+
+    @staticmethod
+    def report(directory, importLines):
+        """
+        Erstellt aus den Rohdaten die Datei mit gefalteten Stacks und den
+        Bericht mit den teuersten Einträgen.
+
+        Parameters
+        ----------
+        directory : str
+            Profilverzeichnis mit den Rohdaten.
+        importLines : list(str)
+            Ausgabe von `-X importtime`.
+        """
+        stats = None
+        path = os.path.join(directory, Profiler.fileStats)
+        if os.path.exists(path): stats = pstats.Stats(path).stats
+        wall = None
+        spans = []
+        path = os.path.join(directory, Profiler.fileSpans)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            wall = data['wall']
+            spans = data['spans']
+        imports = Profiler.parseImports(importLines)
+
+        # Gefaltete Stacks
+        with open(os.path.join(directory, Profiler.fileFolded), 'w') as f:
+            if stats is not None:
+                for stack, tt in Profiler.getStacks(stats).items():
+                    value = round(tt * 1e6)
+                    if value > 0:
+                        f.write('%s %d\n' % (';'.join(('manager',) + stack),
+                                             value))
+            for stack, own, _ in imports:
+                if own > 0:
+                    f.write('%s %d\n' % (';'.join(('imports',) + stack), own))
+            for slug, phase, program, duration in spans:
+                frames = ['children', slug or '<manager>']
+                if phase: frames.append(phase)
+                frames.append(program)
+                value = round(duration * 1e6)
+                if value > 0: f.write('%s %d\n' % (';'.join(frames), value))
+
+        # Tabellen
+        lines = []
+        if wall is not None:
+            lines.append('Dauer des Starts: %.3f s' % wall)
+        if stats is not None:
+            lines += ['', 'Manager: Top %d Funktionen nach Eigenzeit'
+                      % Profiler.top,
+                      '%12s %12s %10s  %s' % ('Eigenzeit', 'Gesamtzeit',
+                                              'Aufrufe', 'Funktion')]
+            entries = sorted(stats.items(), key=lambda e: -e[1][2])
+            for func, (_, nc, tt, ct, _) in entries[:Profiler.top]:
+                lines.append('%10.3f s %10.3f s %10d  %s'
+                             % (tt, ct, nc, Profiler.getName(func)))
+        if imports:
+            lines += ['', 'Importe: Top %d Module nach Gesamtzeit'
+                      % Profiler.top,
+                      '%12s %12s  %s' % ('Eigenzeit', 'Gesamtzeit', 'Modul')]
+            entries = sorted(imports, key=lambda e: -e[2])
+            for stack, own, cumulative in entries[:Profiler.top]:
+                lines.append('%10.3f s %10.3f s  %s'
+                             % (own / 1e6, cumulative / 1e6, stack[-1]))
+        if spans:
+            bySlug = {}
+            for slug, _, _, duration in spans:
+                bySlug.setdefault(slug or '<manager>', []).append(duration)
+            lines += ['', 'Externe Programme je Slug',
+                      '%12s %8s %12s  %s' % ('Gesamtdauer', 'Aufrufe',
+                                             'Längster', 'Slug')]
+            for slug, durations in sorted(bySlug.items(),
+                                          key=lambda e: -sum(e[1])):
+                lines.append('%10.3f s %8d %10.3f s  %s'
+                             % (sum(durations), len(durations),
+                                max(durations), slug))
+            lines += ['', 'Externe Programme: Top %d Aufrufe nach Dauer'
+                      % Profiler.top,
+                      '%12s  %s' % ('Dauer', 'Slug / Phase / Programm')]
+            entries = sorted(spans, key=lambda e: -e[3])
+            for slug, phase, program, duration in entries[:Profiler.top]:
+                lines.append('%10.3f s  %s / %s / %s'
+                             % (duration, slug or '<manager>', phase or '-',
+                                program))
+
+        with open(os.path.join(directory, Profiler.fileReport), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
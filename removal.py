@@ -0,0 +1,137 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+
+from database import Database
+from policy import ScriptError
+
+
+class Removal:
+    """
+    Entfernt veraltete Software in umgekehrter Abhängigkeitsreihenfolge:
+    Eine Software wird erst deinstalliert, wenn alle veraltete Software, die
+    laut Datenbank von ihr abhängt, bereits entfernt ist. Voneinander
+    unabhängige Software wird dabei gleichzeitig entfernt. Kann eine Software
+    nicht entfernt werden, bleiben auch ihre Abhängigkeiten erhalten; der Rest
+    wird unabhängig davon entfernt.
+    """
+
+    # Maximale Anzahl an Software, die gleichzeitig entfernt wird.
+    concurrency = os.cpu_count() or 1
+
+    @staticmethod
+    def setConcurrency(concurrency):
+        """
+        Setzt die maximale Anzahl gleichzeitig entfernter Software.
+
+        Parameters
+        ----------
+        concurrency : int
+            Maximale Anzahl; bei None bleibt die Anzahl der Kerne bestehen.
+        """
+        if concurrency is None: return
+        Removal.concurrency = max(1, int(concurrency))
+
+    @staticmethod
+    def run(slugs, report):
+        """
+        Entfernt die übergebene veraltete Software.
+
+        Parameters
+        ----------
+        slugs : list(str)
+            Slugs der zu entfernenden Software.
+        report : func(str, Exception)
+            Funktion, die im aufrufenden Thread über jede abgeschlossene
+            Software informiert wird: mit None bei Erfolg, ansonsten mit dem
+            Grund als `ScriptError` bzw. `OSError`.
+
+        Returns
+        -------
+        Dictionary mit dem Ergebnis je Slug wie an `report` übergeben.
+        """
+        slugs = set(slugs)
+        dependents = {slug: set() for slug in slugs}
+        for slug in slugs:
+            for d in Database.getRecordedDependencies(slug):
+                if d in slugs and d != slug: dependents[d].add(slug)
+
+        results = {}
+        pending = set(slugs)
+        running = {}
+
+        def finish(slug, error):
+            results[slug] = error
+            report(slug, error)
+
+        with ThreadPoolExecutor(Removal.concurrency) as pool:
+            while pending or running:
+                # Blockierte Software aussortieren und bereite starten. Eine
+                # Blockade kann sich über Abhängigkeiten fortpflanzen, daher
+                # wird in Abhängigkeitsreihenfolge durchlaufen.
+                for slug in Removal.sortByDependents(pending, dependents):
+                    failed = sorted(d for d in dependents[slug]
+                                    if d in results
+                                    and results[d] is not None)
+                    if not Database.isSlugSafeToUninstall(slug):
+                        pending.remove(slug)
+                        finish(slug, ScriptError(
+                            'Wird noch von Software in der Repository '
+                            'benötigt.'))
+                    elif failed:
+                        pending.remove(slug)
+                        finish(slug, ScriptError(
+                            'Abhängige Software %s konnte nicht entfernt '
+                            'werden.' % ', '.join(failed)))
+                    elif all(d in results for d in dependents[slug]):
+                        pending.remove(slug)
+                        running[pool.submit(Database.uninstallOldSlug,
+                                            slug)] = slug
+
+                if not running:
+                    if not pending: break
+                    # Zyklische Abhängigkeiten: Einen Zyklus aufbrechen, indem
+                    # eine beliebige, aber feste Software vorgezogen wird.
+                    slug = min(pending)
+                    pending.remove(slug)
+                    running[pool.submit(Database.uninstallOldSlug,
+                                        slug)] = slug
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    slug = running.pop(future)
+                    try:
+                        future.result()
+                        finish(slug, None)
+                    except (ScriptError, OSError) as e:
+                        finish(slug, e)
+        return results
+
+    @staticmethod
+    def sortByDependents(slugs, dependents):
+        """
+        Sortiert Software so, dass abhängige Software vor der Software kommt,
+        von der sie abhängt.
+
+        Parameters
+        ----------
+        slugs : set(str)
+            Zu sortierende Slugs.
+        dependents : dict
+            Menge der abhängigen Slugs je Slug.
+
+        Returns
+        -------
+        Liste der sortierten Slugs.
+        """
+        order = []
+        visited = set()
+
+        def visit(slug):
+            if slug in visited: return
+            visited.add(slug)
+            for d in sorted(dependents[slug]):
+                if d in slugs: visit(d)
+            order.append(slug)
+
+        for slug in sorted(slugs): visit(slug)
+        return order
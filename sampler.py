@@ -0,0 +1,311 @@
+from collections import deque
+import math
+import os
+import struct
+import threading
+import time
+
+from software import Software
+
+
+class Sampler(threading.Thread):
+    """
+    Thread, der in regelmäßigen Abständen CPU-Auslastung und Speicherbedarf
+    automatisch gestarteter Software samt aller von ihr gestarteten Prozesse
+    aus `/proc` ausliest. Die Messwerte landen je Software in einem
+    Ringpuffer fester Größe, der beim Beenden kompakt als Binärdatei im
+    Logverzeichnis der Software gesichert und beim nächsten Start wieder
+    eingelesen wird.
+
+    Attributes
+    ----------
+    software : list(Software)
+        Software, deren Prozesse überwacht werden.
+    buffers : dict
+        Ringpuffer je Slug mit Tupeln aus Zeitstempel, CPU-Auslastung in
+        Prozent eines Kerns und belegtem Arbeitsspeicher in Byte.
+    ticks : dict
+        Zuletzt gelesene CPU-Zeit in Ticks je Slug und Prozess-ID.
+    """
+
+    # Abstand zwischen zwei Messungen in Sekunden.
+    interval = 5
+
+    # Anzahl an Messungen, die je Software aufbewahrt werden.
+    size = 720
+
+    # Name der Datei im Logverzeichnis der Software, in der die Messungen
+    # gesichert werden.
+    filename = 'samples.bin'
+
+    # Kennung am Dateianfang, die auch das Format versioniert.
+    MAGIC = b'SMS1'
+
+    # Format einer Messung: Zeitstempel, CPU-Auslastung, Arbeitsspeicher.
+    RECORD = struct.Struct('<dfQ')
+
+    # Systemkonstanten, mit denen die Werte aus `/proc` umgerechnet werden.
+    TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    PAGESIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def __init__(self, software):
+        """
+        Erstellt den Thread für die übergebene Software und liest bereits
+        gesicherte Messungen ein.
+
+        Parameters
+        ----------
+        software : list(Software)
+            Software, deren Prozesse überwacht werden sollen.
+        """
+        super().__init__(daemon=True)
+        self.software = software
+        self.buffers = {s.slug: deque(Sampler.load(s.slug),
+                                      maxlen=Sampler.size)
+                        for s in software}
+        self.ticks = {}
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def configure(interval=None, size=None):
+        """
+        Passt Messabstand und Puffergröße an. Nicht angegebene Werte bleiben
+        unverändert.
+
+        Parameters
+        ----------
+        interval : float
+            Abstand zwischen zwei Messungen in Sekunden; 0 deaktiviert die
+            Messung.
+        size : int
+            Anzahl an Messungen, die je Software aufbewahrt werden.
+        """
+        if interval is not None: Sampler.interval = float(interval)
+        if size is not None: Sampler.size = int(size)
+
+    @staticmethod
+    def isSupported():
+        """
+        Ermittelt, ob Messungen möglich sind, also ob es ein Linux-artiges
+        `/proc` gibt und die Messung nicht deaktiviert ist.
+
+        Returns
+        -------
+        Ob gemessen werden kann.
+        """
+        return Sampler.interval > 0 and os.path.exists('/proc/self/stat')
+
+    def run(self):
+        """
+        Misst, bis der Thread über `stop` beendet wird.
+        """
+        while not self.stopped.wait(Sampler.interval): self.sample()
+
+    def stop(self):
+        """
+        Beendet den Thread und sichert die Messungen.
+        """
+        self.stopped.set()
+        if self.is_alive(): self.join()
+        self.save()
+
+    def sample(self):
+        """
+        Führt eine Messung für alle laufende Software durch. Die
+        CPU-Auslastung ergibt sich aus der Differenz der CPU-Zeit jedes
+        Prozesses zur vorherigen Messung; neu hinzugekommene Prozesse gehen
+        mit ihrer gesamten CPU-Zeit ein.
+        """
+        now = time.time()
+        children = None
+        for s in self.software:
+            if s.process is None or s.process.poll() is not None: continue
+            pids, children = Sampler.getProcessTree(s.process.pid, children)
+
+            last = self.ticks.get(s.slug)
+            ticks = {}
+            rss = 0
+            for pid in pids:
+                stat = Sampler.readStat(pid)
+                if stat is None: continue
+                ticks[pid], pages = stat
+                rss += pages * Sampler.PAGESIZE
+            self.ticks[s.slug] = (now, ticks)
+            if last is None: continue
+
+            used = sum(t - last[1].get(pid, 0) for pid, t in ticks.items())
+            elapsed = max(now - last[0], 1e-6)
+            cpu = max(0, used) / Sampler.TICKS / elapsed * 100
+            self.buffers[s.slug].append((now, cpu, rss))
+
+    @staticmethod
+    def readStat(pid):
+        """
+        Liest CPU-Zeit und Arbeitsspeicher eines Prozesses aus
+        `/proc/<pid>/stat`.
+
+        Parameters
+        ----------
+        pid : int
+            ID des Prozesses.
+
+        Returns
+        -------
+        Tupel aus CPU-Zeit in Ticks (Nutzer und System) und belegten Seiten
+        oder None, falls der Prozess nicht mehr existiert.
+        """
+        try:
+            with open('/proc/%d/stat' % pid, 'rb') as f:
+                stat = f.read()
+        except OSError:
+            return None
+        # Der Prozessname steht in Klammern und darf selbst Leerzeichen
+        # enthalten, daher erst nach der letzten Klammer aufteilen.
+        fields = stat[stat.rfind(b')') + 2:].split()
+        return int(fields[11]) + int(fields[12]), int(fields[21])
+
+    @staticmethod
+    def getProcessTree(pid, children=None):
+        """
+        Ermittelt einen Prozess samt aller Nachfahren. Bevorzugt werden dazu
+        die `children`-Dateien der Threads gelesen; fehlen diese, wird einmalig
+        je Messung ganz `/proc` nach Elternprozessen durchsucht.
+
+        Parameters
+        ----------
+        pid : int
+            ID des obersten Prozesses.
+        children : dict
+            Bereits ermittelte Zuordnung von Eltern- zu Kindprozessen aus einer
+            vorherigen Suche oder None.
+
+        Returns
+        -------
+        Tupel aus der Liste der Prozess-IDs und der ggf. ermittelten
+        Zuordnung, die an den nächsten Aufruf übergeben werden kann.
+        """
+        pids = []
+        pending = [pid]
+        while pending:
+            current = pending.pop()
+            pids.append(current)
+            if children is not None:
+                pending.extend(children.get(current, []))
+                continue
+            try:
+                for task in os.listdir('/proc/%d/task' % current):
+                    with open('/proc/%d/task/%s/children'
+                              % (current, task), 'rb') as f:
+                        pending.extend(int(c) for c in f.read().split())
+            except FileNotFoundError:
+                if os.path.exists('/proc/%d' % current):
+                    # Der Kernel bietet keine `children`-Dateien an.
+                    children = Sampler.getChildren()
+                    return Sampler.getProcessTree(pid, children)
+            except OSError:
+                continue
+        return pids, children
+
+    @staticmethod
+    def getChildren():
+        """
+        Ermittelt durch Suche in `/proc` zu jedem Prozess seine Kindprozesse.
+
+        Returns
+        -------
+        Dictionary mit der ID des Elternprozesses als Key und der Liste der
+        IDs seiner Kindprozesse als Value.
+        """
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit(): continue
+            try:
+                with open('/proc/%s/stat' % entry, 'rb') as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            ppid = int(stat[stat.rfind(b')') + 2:].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        return children
+
+    @staticmethod
+    def getFile(slug):
+        """
+        Gibt den Pfad zur Datei mit den gesicherten Messungen einer Software
+        zurück.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der Software.
+
+        Returns
+        -------
+        Pfad zur Datei im Logverzeichnis der Software.
+        """
+        return os.path.join(Software.dirLog, slug, Sampler.filename)
+
+    def save(self):
+        """
+        Sichert die Ringpuffer aller überwachten Software.
+        """
+        for slug, buffer in self.buffers.items():
+            if len(buffer) < 1: continue
+            path = Sampler.getFile(slug)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(Sampler.MAGIC)
+                for record in buffer: f.write(Sampler.RECORD.pack(*record))
+
+    @staticmethod
+    def load(slug):
+        """
+        Liest die gesicherten Messungen einer Software ein.
+
+        Parameters
+        ----------
+        slug : str
+            Slug der Software.
+
+        Returns
+        -------
+        Liste von Tupeln aus Zeitstempel, CPU-Auslastung und Arbeitsspeicher;
+        leer, falls keine (gültige) Datei vorhanden ist.
+        """
+        path = Sampler.getFile(slug)
+        if not os.path.exists(path): return []
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(Sampler.MAGIC): return []
+        data = data[len(Sampler.MAGIC):]
+        data = data[:len(data) - len(data) % Sampler.RECORD.size]
+        return list(Sampler.RECORD.iter_unpack(data))
+
+    @staticmethod
+    def summarize(samples):
+        """
+        Fasst Messungen zusammen.
+
+        Parameters
+        ----------
+        samples : list(tuple)
+            Messungen wie von `load` geliefert.
+
+        Returns
+        -------
+        Dictionary mit Anzahl der Messungen, Median und 95. Perzentil der
+        CPU-Auslastung in Prozent sowie dem höchsten Arbeitsspeicherbedarf in
+        Byte oder None, falls keine Messungen vorliegen.
+        """
+        if len(samples) < 1: return None
+        cpu = sorted(s[1] for s in samples)
+
+        def percentile(p):
+            return cpu[max(0, math.ceil(p / 100 * len(cpu)) - 1)]
+
+        return {
+            'count': len(samples),
+            'cpu50': percentile(50),
+            'cpu95': percentile(95),
+            'rssPeak': max(s[2] for s in samples),
+        }
@@ -1,12 +1,20 @@
 from datetime import datetime, timedelta
 from glob import glob
 import os
+import re
 import semver
 import shutil
+import socket
 import subprocess
 import sys
+import time
 import yaml
 
+from environment import Environment
+from limits import Limits
+from policy import Policy, ScriptError, ScriptTimeout
+from profiler import Profiler
+
 
 class Software:
     """
@@ -33,12 +41,20 @@ class Software:
     process : subprocess
         Objekt, das mit einer subprocess-Instanz befüllt ist, wenn die Software
         läuft. Kann beispielsweise genutzt werden, um die Software zu beenden.
+    logStdout : str
+        Pfad zur Logdatei mit der Standardausgabe des zuletzt gestarteten
+        Prozesses.
     """
 
     # Liste mit methoden, die über Änderungen eines Softwarestatus informiert
     # werden wollen.
     stateListeners = []
 
+    # Methoden, die erst nach allen übrigen informiert werden. Sie können so
+    # Folgeänderungen an anderer Software vornehmen, ohne dass diese vor ihrer
+    # Ursache gemeldet werden.
+    lateStateListeners = []
+
     # Kodierung der verschiedenen, zur Verfügung stehenden Status, die die
     # Software annehmen kann.
     UNKNOWN = -1
@@ -49,16 +65,26 @@ class Software:
     INSTALLED = 10
     UPDATING = 15
     UPDATED = 20
+    STARTING = 25
     AUTOSTARTED = 30
     ERROR = -2
+    TIMEOUT = -3
 
     # Zielverzeichnis, in dem Software installiert werden soll.
     dirTarget = ''
 
+    # Verzeichnis, in dem die Deinstallationsskripte gecacht werden.
+    dirUninstaller = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'uninstaller')
+
+    # Standardwert in Sekunden, wie lange auf die Bereitschaft einer
+    # gestarteten Software gewartet wird.
+    readyTimeout = 30
+
     # Verzeichnis, in dem Logdateien abgelegt werden sollen.
     dirLog = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')
 
-    def __init__(self, path):
+    def __init__(self, path, config=None, scripts=None):
         """
         Erstellt das Software-Objekt, das sich am entsprechenden Pfad befindet.
 
@@ -66,13 +92,23 @@ class Software:
         ----------
         path : str
             Pfad, in dem sich die zu verwaltende Software befindet.
+        config : dict
+            Bereits bekannte Konfiguration, etwa aus dem Index der Repository.
+            Bei None wird sie aus der `config.yml` gelesen.
+        scripts : dict
+            Bereits bekannte Skripte der Software mit Dateiname als Key. Bei
+            None wird bei Bedarf im Dateisystem nachgesehen.
         """
         self.path = path
         self.slug = os.path.basename(os.path.normpath(self.path))
-        with open(os.path.join(self.path, 'config.yml'), 'r') as f:
-            self.config = yaml.full_load(f) or {}
+        if config is None:
+            with open(os.path.join(self.path, 'config.yml'), 'r') as f:
+                config = yaml.full_load(f) or {}
+        self.config = config
+        self.scripts = scripts
         self.state = Software.UNKNOWN
         self.process = None
+        self.logStdout = None
 
     @staticmethod
     def deleteOldLogs():
@@ -107,6 +143,23 @@ class Software:
         """
         Software.dirTarget = dirTarget
 
+    def hasScript(self, name):
+        """
+        Ermittelt, ob die Software in der Repository ein bestimmtes Skript
+        mitbringt.
+
+        Parameters
+        ----------
+        name : str
+            Dateiname des Skripts, beispielsweise `install.py`.
+
+        Returns
+        -------
+        Ob das Skript vorhanden ist.
+        """
+        if self.scripts is not None: return name in self.scripts
+        return os.path.exists(os.path.join(self.path, name))
+
     def getName(self):
         """
         Ermittelt einen Namen für die Software: Falls vorhanden wird dieser aus
@@ -152,6 +205,7 @@ class Software:
         """
         self.state = state
         for method in Software.stateListeners: method(self)
+        for method in Software.lateStateListeners: method(self)
 
     def install(self):
         """
@@ -164,15 +218,17 @@ class Software:
 
         # Überprüfung, ob Installations- und Deinstallationsskript vorhanden
         # sind, denn ansonsten schlägt die Installation später fehl.
-        if not os.path.exists(os.path.join(self.path, 'install.py')):
+        if not self.hasScript('install.py'):
             return self.setError('Kein Installationsskript vorhanden.')
-        if not os.path.exists(os.path.join(self.path, 'uninstall.py')):
+        if not self.hasScript('uninstall.py'):
             return self.setError('Kein Deinstallationsskript vorhanden.')
 
         # PIP-Dependencies
         self.setState(Software.INSTALLING_PIP_DEPENDENCIES)
-        for d in self.getPipDependencies():
-            subprocess.check_call([sys.executable, '-m', 'pip', 'install', d])
+        try:
+            self.installPipDependencies()
+        except (ScriptError, OSError) as e:
+            return self.setScriptError(e)
 
         # Dependencies
         self.setState(Software.INSTALLING_DEPENDENCIES)
@@ -182,21 +238,42 @@ class Software:
                 return self.setError('Abhängigkeit ist nicht in der '
                                      'Repository.')
             software.install()
+            # Der Fehler wurde ggf. bereits über die Abhängigkeit gesetzt.
+            if self.hasError(): return
             if not software.isInstalled():
                 return self.setError('Installation konnte nicht abgeschlossen '
                                      'werden.')
 
-        # Installationsskript ausführen
+        # Installationsskript ausführen und Deinstallationsskript cachen
         self.setState(Software.INSTALLING)
-        subprocess.check_call([sys.executable, 'install.py',
-                               self.getTargetDir()], cwd=self.path)
-
-        # Deinstallationsskript cachen
-        self.cacheUninstaller()
+        try:
+            with Profiler.attribute(self.slug, 'install'):
+                Policy.call([self.getPython(), 'install.py',
+                             self.getTargetDir()], cwd=self.path,
+                            timeout=self.getTimeout('install'))
+            self.cacheUninstaller()
+        except (ScriptError, OSError) as e:
+            return self.setScriptError(e)
 
         # Fertig installiert
         self.setState(Software.INSTALLED)
 
+    def installPipDependencies(self):
+        """
+        Installiert die PIP-Pakete der Software: in die eigene Umgebung, sofern
+        die Isolation aktiviert ist, ansonsten in den Interpreter des Managers.
+        Fehler beim Herunterladen gelten als vorübergehend und werden
+        wiederholt.
+        """
+        with Profiler.attribute(self.slug, 'pip'):
+            if Environment.isEnabled():
+                Environment(self.slug).installPackages(
+                    self.getPipDependencies(), self.getTimeout('pip'))
+                return
+            for d in self.getPipDependencies():
+                Policy.call([sys.executable, '-m', 'pip', 'install', d],
+                            transient=True, timeout=self.getTimeout('pip'))
+
     def cacheUninstaller(self):
         """
         Sichert das Deinstallationsskript, damit dieses später ausgeführt
@@ -222,12 +299,17 @@ class Software:
         if not self.isInstalled(): return
         self.setState(Software.UPDATING)
 
-        if os.path.exists(os.path.join(self.path, 'update.py')):
+        if self.hasScript('update.py'):
             # Wenn es ein Updateskript gibt: Ausführen
-            subprocess.check_call([sys.executable, 'update.py',
-                                   self.getTargetDir(), str(currentVersion)],
-                                  cwd=self.path)
-            self.cacheUninstaller()
+            try:
+                with Profiler.attribute(self.slug, 'update'):
+                    Policy.call([self.getPython(), 'update.py',
+                                 self.getTargetDir(), str(currentVersion)],
+                                cwd=self.path,
+                                timeout=self.getTimeout('update'))
+                self.cacheUninstaller()
+            except (ScriptError, OSError) as e:
+                return self.setScriptError(e)
         else:
             # Wenn es kein Updateskript gibt, dann eben löschen und neu
             # installieren
@@ -236,6 +318,8 @@ class Software:
                 return self.setError('Deinstallierskript hat nicht '
                                      'funktioniert.')
             self.install()
+            # Fehler wurden bereits von der Installation gesetzt.
+            if not self.isInstalled(): return
 
         self.setState(Software.UPDATED)
 
@@ -245,10 +329,15 @@ class Software:
         """
         if not self.isInstalled(): return
         uninstaller = self.getUninstaller()
-        subprocess.check_call([sys.executable, os.path.basename(uninstaller),
-                               self.getTargetDir()],
-                              cwd=os.path.dirname(uninstaller))
-        os.remove(uninstaller)
+        try:
+            with Profiler.attribute(self.slug, 'uninstall'):
+                Policy.call([self.getPython(), os.path.basename(uninstaller),
+                             self.getTargetDir()],
+                            cwd=os.path.dirname(uninstaller),
+                            timeout=self.getTimeout('uninstall'))
+            os.remove(uninstaller)
+        except (ScriptError, OSError) as e:
+            return self.setScriptError(e)
         self.setState(Software.UNINSTALLED)
 
     def getUninstaller(self):
@@ -259,10 +348,9 @@ class Software:
         -------
         Pfad, an dessen Stelle sich das Deinstallationsskript befinden sollte.
         """
-        return os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                            'uninstaller', self.slug + '.py')
+        return os.path.join(Software.dirUninstaller, self.slug + '.py')
 
-    def setError(self, msg):
+    def setError(self, msg, state=None):
         """
         Setzt eine Fehlermeldung und den Fehlerstatus der Software.
 
@@ -270,9 +358,44 @@ class Software:
         ----------
         msg : str
             Nachricht, die als Fehlergrund hinterlegt werden soll.
+        state : int
+            Zu setzender Fehlerstatus, standardmäßig `ERROR`.
         """
         self.error_msg = msg
-        self.setState(Software.ERROR)
+        self.setState(Software.ERROR if state is None else state)
+
+    def setScriptError(self, error):
+        """
+        Setzt den Fehlerstatus anhand eines fehlgeschlagenen Skripts. Eine
+        Zeitüberschreitung wird dabei als eigener Status geführt.
+
+        Parameters
+        ----------
+        error : Exception
+            Der aufgetretene `ScriptError` bzw. `OSError`.
+        """
+        self.setError(str(error), Software.TIMEOUT
+                      if isinstance(error, ScriptTimeout) else None)
+
+    def getTimeout(self, phase):
+        """
+        Ermittelt die Zeitbegrenzung für eine Phase dieser Software. In der
+        Konfiguration kann unter `timeout` entweder ein Wert für alle Phasen
+        oder ein Dictionary mit Werten je Phase angegeben werden.
+
+        Parameters
+        ----------
+        phase : str
+            Eine der Phasen `pip`, `install`, `update` oder `uninstall`.
+
+        Returns
+        -------
+        Zeitbegrenzung in Sekunden oder None, falls die standardmäßige
+        Zeitbegrenzung gelten soll.
+        """
+        timeout = self.config.get('timeout')
+        if isinstance(timeout, dict): return timeout.get(phase)
+        return timeout
 
     def isInstalled(self):
         """
@@ -285,7 +408,7 @@ class Software:
         return self.state >= Software.INSTALLED
 
     @staticmethod
-    def registerStateListener(method):
+    def registerStateListener(method, late=False):
         """
         Statische Methode, die eine andere Methode registriert. Diese wird dann
         immer über Statusänderungen aller Software-Instanzen informiert.
@@ -295,8 +418,11 @@ class Software:
         method : func(Software)
             Eine Methode, die über Statusänderungen informiert wird, indem sie
             als Parameter das betroffene Softwareobjekt übergeben bekommt.
+        late : bool
+            Ob die Methode erst nach allen übrigen informiert werden soll.
         """
-        Software.stateListeners.append(method)
+        if late: Software.lateStateListeners.append(method)
+        else: Software.stateListeners.append(method)
 
     def hasError(self):
         """
@@ -306,7 +432,8 @@ class Software:
         -------
         Ob sich die Software in einem Fehlerstatus befindet.
         """
-        return self.state in [Software.ERROR, Software.UNKNOWN]
+        return self.state in [Software.ERROR, Software.TIMEOUT,
+                              Software.UNKNOWN]
 
     def getVersion(self):
         """
@@ -331,6 +458,18 @@ class Software:
         """
         return os.path.join(Software.dirTarget, self.slug)
 
+    def getPython(self):
+        """
+        Gibt den Interpreter zurück, mit dem die Skripte dieser Software
+        ausgeführt werden.
+
+        Returns
+        -------
+        Pfad zum Interpreter der eigenen Umgebung, sofern die Isolation
+        aktiviert ist, ansonsten der des Managers.
+        """
+        return Environment.getInterpreter(self.slug)
+
     def isRunnable(self):
         """
         Überprüft, ob die aktuelle Software ausführbar ist, also ein Skript in
@@ -356,10 +495,79 @@ class Software:
         logStdout = os.path.join(logpath, basetime + '_stdout.log')
         logStderr = os.path.join(logpath, basetime + '_stderr.log')
 
-        with open(logStdout, 'wb', encoding='utf-8') as out, \
-                open(logStderr, 'wb', encoding='utf-8') as err:
+        # Die Logdateien werden binär geöffnet, da die Ausgaben des Skripts
+        # unverändert übernommen werden.
+        with open(logStdout, 'wb') as out, open(logStderr, 'wb') as err:
             self.process = subprocess.Popen(
-                [sys.executable, self.config.get('run')],
+                Limits(self.config).getCommand(
+                    [self.getPython(), self.config.get('run')]),
                 cwd=self.getTargetDir(), stdout=out, stderr=err)
+        self.logStdout = logStdout
 
-        self.setState(Software.AUTOSTARTED)
+        self.setState(Software.STARTING)
+
+    def waitReady(self):
+        """
+        Wartet, bis die gestartete Software laut ihrer Konfiguration unter
+        `ready` bereit ist. Mögliche Bedingungen sind eine Datei im
+        Zielverzeichnis (`file`), ein offener Port auf localhost (`port`) und
+        ein regulärer Ausdruck in der Standardausgabe (`log`); sind mehrere
+        angegeben, müssen alle erfüllt sein. Ohne Bedingungen gilt die
+        Software sofort als bereit.
+
+        Returns
+        -------
+        Ob die Software bereit ist. Andernfalls wird der Fehlerstatus gesetzt.
+        """
+        if self.state != Software.STARTING: return False
+        ready = self.config.get('ready') or {}
+        deadline = time.monotonic() + ready.get('timeout',
+                                                Software.readyTimeout)
+        pattern = re.compile(ready['log']) if 'log' in ready else None
+        log = ''
+
+        with open(self.logStdout, 'rb') as f:
+            while True:
+                # Neue Ausgaben einlesen; nur die letzte, ggf. unvollständige
+                # Zeile wird für den nächsten Durchlauf aufbewahrt.
+                if pattern is not None:
+                    log += f.read().decode('utf-8', errors='replace')
+                    if pattern.search(log): pattern = None
+                    else: log = log[log.rfind('\n') + 1:]
+
+                if pattern is None and self.isReady(ready):
+                    self.setState(Software.AUTOSTARTED)
+                    return True
+
+                if self.process.poll() is not None:
+                    self.setError('Beendet, bevor die Software bereit war '
+                                  '(Code %d).' % self.process.returncode)
+                    return False
+                if time.monotonic() > deadline:
+                    self.setError('Software wurde nicht rechtzeitig bereit.')
+                    return False
+                time.sleep(0.1)
+
+    def isReady(self, ready):
+        """
+        Überprüft die Bereitschaftsbedingungen für Datei und Port.
+
+        Parameters
+        ----------
+        ready : dict
+            Bereitschaftsbedingungen aus der Konfiguration.
+
+        Returns
+        -------
+        Ob alle überprüften Bedingungen erfüllt sind.
+        """
+        if 'file' in ready and not os.path.exists(
+                os.path.join(self.getTargetDir(), ready['file'])):
+            return False
+        if 'port' in ready:
+            try:
+                socket.create_connection(('localhost', ready['port']),
+                                         timeout=0.5).close()
+            except OSError:
+                return False
+        return True
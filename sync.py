@@ -0,0 +1,219 @@
+import os
+import subprocess
+
+from policy import Policy, ScriptError
+from profiler import Profiler
+
+
+class Sync:
+    """
+    Aktualisiert eine Git-Arbeitskopie ohne vollständigen `git pull`: Es wird
+    nur der neueste Commit des Upstream-Branches flach geholt und die
+    Arbeitskopie ohne Merge auf ihn gesetzt. Auf Wunsch wird die Arbeitskopie
+    zudem per Sparse-Checkout auf ein Unterverzeichnis beschränkt; Dateien
+    außerhalb werden dann auch nicht heruntergeladen, sofern der Server dies
+    unterstützt. Ist der Server zu langsam oder schlägt etwas fehl, bleibt
+    bzw. wird die Arbeitskopie auf dem letzten erfolgreich geholten Commit.
+
+    Da auf den Rechnern nie lokal committet wird, geht beim Setzen auf den
+    geholten Commit nichts verloren; lokale Änderungen an Dateien bleiben
+    erhalten oder verhindern die Aktualisierung.
+
+    Attributes
+    ----------
+    path : str
+        Verzeichnis, das aktualisiert werden soll.
+    root : str
+        Wurzel der Arbeitskopie, in der sich das Verzeichnis befindet, oder
+        None, falls es nicht in Git liegt.
+    """
+
+    # Zeitbegrenzung für das Holen vom Server in Sekunden.
+    timeout = 60
+
+    # Anzahl an Commits, die vom Server geholt werden.
+    depth = 1
+
+    # Referenz auf den letzten erfolgreich geholten Commit.
+    LASTGOOD = 'refs/softwaremanager/last-good'
+
+    # Umgebungsvariable, über die `main.py` dem Manager die Wurzel der bereits
+    # aktualisierten Arbeitskopie mitteilt.
+    ENV = 'SOFTWAREMANAGER_SYNCED'
+
+    def __init__(self, path):
+        """
+        Erstellt das Sync-Objekt für das entsprechende Verzeichnis.
+
+        Parameters
+        ----------
+        path : str
+            Verzeichnis, das aktualisiert werden soll.
+        """
+        self.path = os.path.abspath(path)
+        try:
+            self.root = subprocess.check_output(
+                ['git', 'rev-parse', '--show-toplevel'], cwd=self.path,
+                stderr=subprocess.DEVNULL).decode().strip()
+        except (subprocess.CalledProcessError, OSError):
+            self.root = None
+
+    @staticmethod
+    def configure(timeout=None, depth=None):
+        """
+        Passt Zeitbegrenzung und Tiefe an. Nicht angegebene Werte bleiben
+        unverändert.
+
+        Parameters
+        ----------
+        timeout : float
+            Zeitbegrenzung für das Holen vom Server in Sekunden.
+        depth : int
+            Anzahl an Commits, die vom Server geholt werden.
+        """
+        if timeout is not None: Sync.timeout = float(timeout)
+        if depth is not None: Sync.depth = int(depth)
+
+    def git(self, *args, timeout=0):
+        """
+        Führt einen Git-Befehl in der Arbeitskopie aus.
+
+        Parameters
+        ----------
+        *args : list(str)
+            Parameter für Git.
+        timeout : float
+            Zeitbegrenzung in Sekunden; 0 für unbegrenzt.
+
+        Returns
+        -------
+        Die Ausgabe des Befehls ohne umgebende Leerzeichen.
+        """
+        with Profiler.attribute(None, 'sync'):
+            return Policy.call(['git'] + list(args), cwd=self.root,
+                               capture=True, timeout=timeout).decode().strip()
+
+    def contains(self, path):
+        """
+        Ermittelt, ob ein Verzeichnis innerhalb der Arbeitskopie liegt.
+
+        Parameters
+        ----------
+        path : str
+            Zu überprüfendes Verzeichnis.
+
+        Returns
+        -------
+        Ob das Verzeichnis in der Arbeitskopie liegt.
+        """
+        if self.root is None: return False
+        relative = os.path.relpath(os.path.realpath(path),
+                                   os.path.realpath(self.root))
+        return relative != '..' and not relative.startswith('..' + os.sep)
+
+    def isSynced(self):
+        """
+        Ermittelt, ob die Arbeitskopie in diesem Lauf bereits von `main.py`
+        aktualisiert wurde.
+
+        Returns
+        -------
+        Ob die Aktualisierung übersprungen werden kann.
+        """
+        synced = os.environ.get(Sync.ENV)
+        return self.root is not None and synced is not None \
+            and os.path.samefile(self.root, synced)
+
+    def update(self, sparse=False):
+        """
+        Aktualisiert die Arbeitskopie auf den neuesten Commit ihres
+        Upstream-Branches.
+
+        Parameters
+        ----------
+        sparse : bool
+            Ob die Arbeitskopie auf das Verzeichnis beschränkt werden soll.
+            Darf nur gesetzt werden, wenn nichts außerhalb benötigt wird.
+
+        Returns
+        -------
+        Ob die Arbeitskopie auf dem neuesten Stand ist. Bei False ist sie auf
+        dem letzten erfolgreich geholten Commit.
+        """
+        if self.root is None: return False
+        try:
+            remote, branch = self.getUpstream()
+            if sparse: self.restrict()
+            # Ohne Dateiinhalte holen, wenn ohnehin nur ein Teil ausgecheckt
+            # wird; fehlende Inhalte holt Git beim Auschecken nach. Server ohne
+            # Unterstützung ignorieren den Filter.
+            self.git('fetch', '--quiet', '--no-tags',
+                     '--depth=%d' % Sync.depth,
+                     *(['--filter=blob:none'] if sparse else []),
+                     remote, branch, timeout=Sync.timeout)
+            # Durch die flache Historie ist ein Fast-Forward-Merge nicht
+            # prüfbar, daher wird der Branch direkt umgesetzt.
+            self.git('reset', '--keep', 'FETCH_HEAD', timeout=Sync.timeout)
+            self.git('update-ref', Sync.LASTGOOD, 'HEAD')
+            return True
+        except ScriptError:
+            self.fallback()
+            return False
+
+    def getUpstream(self):
+        """
+        Ermittelt Remote und Branch, von denen der aktuelle Branch
+        aktualisiert wird. Diese werden direkt aus der Konfiguration gelesen,
+        da sich der abgekürzte Name (`@{u}`) nicht eindeutig aufteilen lässt.
+
+        Returns
+        -------
+        Tupel aus Name des Remotes und vollständiger Referenz des Branches
+        dort.
+
+        Raises
+        ------
+        ScriptError
+            Falls kein Branch ausgecheckt ist oder dieser keinen Upstream auf
+            einem Remote hat.
+        """
+        local = self.git('symbolic-ref', '--quiet', '--short', 'HEAD')
+        remote = self.git('config', '--get', 'branch.%s.remote' % local)
+        merge = self.git('config', '--get', 'branch.%s.merge' % local)
+        if remote in ['', '.'] or not merge.startswith('refs/heads/'):
+            raise ScriptError('%s hat keinen Upstream auf einem Remote.'
+                              % local)
+        return remote, merge
+
+    def restrict(self):
+        """
+        Beschränkt die Arbeitskopie per Sparse-Checkout auf das Verzeichnis,
+        sofern dies noch nicht geschehen ist.
+        """
+        relative = os.path.relpath(self.path, self.root).replace(os.sep, '/')
+        if relative == '.': return
+        # `sparse-checkout list` meldet bei nicht beschränkten Arbeitskopien
+        # einen Fehler auf der Konsole, daher zuerst die Einstellung prüfen.
+        try:
+            sparse = self.git('config', '--get', 'core.sparseCheckout')
+        except ScriptError:
+            sparse = 'false'
+        if sparse == 'true' and self.git('sparse-checkout', 'list') \
+                == relative:
+            return
+        self.git('sparse-checkout', 'set', relative)
+
+    def fallback(self):
+        """
+        Setzt die Arbeitskopie auf den letzten erfolgreich geholten Commit
+        zurück, sofern sie nicht ohnehin dort steht.
+        """
+        try:
+            lastGood = self.git('rev-parse', '--verify', '--quiet',
+                                Sync.LASTGOOD)
+            if lastGood != self.git('rev-parse', 'HEAD'):
+                self.git('reset', '--keep', lastGood)
+        except ScriptError:
+            # Es gibt noch keinen letzten erfolgreichen Commit; dann bleibt es
+            # beim aktuellen Stand.
+            pass